@@ -4,6 +4,37 @@ import basic_block
 import cfg as data
 from collections import OrderedDict
 from abc import ABC, abstractmethod
+from heapq import heapify, heappop, heappush
+from itertools import compress
+
+BITS = bytes.maketrans(b'01', b'\x00\x01')
+
+def postorder(cfg):
+    """Block labels in depth-first postorder along successor edges.
+
+    The walk starts at the entry. Blocks it cannot reach are walked from
+    afterwards in layout order, so every block is listed exactly once.
+    """
+    order = []
+    visited = set()
+    for root in cfg.bb:
+        if root in visited:
+            continue
+
+        visited.add(root)
+        stack = [(root, iter(cfg.succ.get(root, [])))]
+        while stack:
+            b, succ = stack[-1]
+            for s in succ:
+                if s in cfg.bb and s not in visited:
+                    visited.add(s)
+                    stack.append((s, iter(cfg.succ.get(s, []))))
+                    break
+            else:
+                stack.pop()
+                order.append(b)
+
+    return order
 
 def form_cfgs(prog):
     cfgs = []
@@ -16,6 +47,10 @@ def form_cfgs(prog):
 
 class Analyzer(ABC):
     """Analyzer is a base class for specific analysis.
+
+    Sets of variables are bit vectors: every variable name of the function
+    gets a bit position and a set is an int. Each block's gen/kill masks are
+    computed once, so merge and transfer are a few big-int operations.
     """
     cfgs = []
     # Forward: 0
@@ -26,12 +61,19 @@ class Analyzer(ABC):
         self.cfgs = cfgs
         self.start = 0
 
-    def init_input(self, od: OrderedDict):
-        input = {}
-        entry = list(od)[self.start]
-        input[entry] = []
+    def bit(self, var):
+        """The mask of var, giving it the next free bit the first time."""
+        if var not in self.bits:
+            self.bits[var] = len(self.bits)
+            self.vars.append(var)
+
+        return 1 << self.bits[var]
 
-        return input
+    def to_set(self, mask):
+        """The set of variable names whose bits are set in mask."""
+        # bin() lists bits highest first; turn '0'/'1' into 0/1 selectors
+        digits = bin(mask)[:1:-1].encode().translate(BITS)
+        return set(compress(self.vars, digits))
 
     # to_update is a predecessor or successor map.
     # If 'out' is changed, then the current basic block's pred or succ needs to be updated.
@@ -40,36 +82,64 @@ class Analyzer(ABC):
     def analyze_cfg(self, cfg: data.CFG, to_update):
         """A general data flow analysis solver using the worklist algorithm.
         """
-        input = self.init_input(cfg.bb)
-        out = self.init_out(cfg.bb)
-
-        worklist = list(cfg.bb)
+        self.bits = {}
+        self.vars = []
+        masks = {k: self.gen_kill(instrs) for k, instrs in cfg.bb.items()}
+
+        input = {k: 0 for k in cfg.bb}
+        out = {k: gen for k, (gen, _) in masks.items()}
+
+        # Visit blocks in passes over reverse postorder for forward analyses
+        # and postorder for backward ones, so a block usually sees its inputs
+        # settled. A pass is a heap of positions in that order; a block that
+        # needs another visit joins the current pass if it comes after the
+        # block being visited and the next pass otherwise.
+        order = postorder(cfg)
+        if self.start == 0:
+            order.reverse()
+        rank = {b: i for i, b in enumerate(order)}
+
+        worklist = list(range(len(order)))
+        later = []
+        queued = set(order)
+        self.iterations = 0
         while worklist:
-            b = worklist[self.start]
+            pos = heappop(worklist)
+            b = order[pos]
+            queued.remove(b)
+            self.iterations += 1
             input[b] = self.merge(cfg, b, out)
-            old = len(out[b])
-            out[b] = self.transfer(cfg.bb[b], input[b])
+            old = out[b]
+            out[b] = self.transfer(masks[b], input[b])
 
-            if old != len(out[b]):
+            if old != out[b]:
                 for bb in to_update[b]:
-                    if bb not in worklist:
-                        worklist.append(bb)
-            else:
-                worklist.remove(b)
-
+                    if bb not in queued:
+                        queued.add(bb)
+                        if rank[bb] > pos:
+                            heappush(worklist, rank[bb])
+                        else:
+                            later.append(rank[bb])
+
+            if not worklist:
+                worklist, later = later, []
+                heapify(worklist)
+
+        input = {k: self.to_set(mask) for k, mask in input.items()}
+        out = {k: self.to_set(mask) for k, mask in out.items()}
         return (input, out)
 
+    def transfer(self, gen_kill, input):
+        gen, kill = gen_kill
+        return gen | (input & ~kill)
+
     @abstractmethod
     def analyze(self):
         raise NotImplementedError("analyze() must be implemented")
 
     @abstractmethod
-    def init_out(self, od: OrderedDict):
-        raise NotImplementedError("init_out() must be implemented")
-
-    @abstractmethod
-    def transfer(self, instrs, input):
-        raise NotImplementedError("transfer() must be implemented")
+    def gen_kill(self, instrs):
+        raise NotImplementedError("gen_kill() must be implemented")
 
     @abstractmethod
     def merge(self, cfg, curr, out):
@@ -89,43 +159,32 @@ class Live(Analyzer):
             # We need to swap input and out because we're analyzing in backwards.
             print_analysis(out, input)
 
-    def init_out(self, od: OrderedDict):
-        out = {}
-        for k, instrs in od.items():
-            out[k] = set()
-            for instr in reversed(instrs):
-                # Don't want to remove variable i in the following example
-                # i: int = sub i one
-                # Thus, we check dest first before adding i
-                if 'dest' in instr and instr['dest'] in out[k]:
-                    out[k].remove(instr['dest'])
+    def gen_kill(self, instrs):
+        """Variables used before any definition in the block, and defined ones."""
+        use = 0
+        defs = 0
+        for instr in reversed(instrs):
+            # Don't want to remove variable i in the following example
+            # i: int = sub i one
+            # Thus, we check dest first before adding i
+            if 'dest' in instr:
+                dest = self.bit(instr['dest'])
+                use &= ~dest
+                defs |= dest
 
-                if 'args' in instr:
-                    for arg in instr['args']:
-                        out[k].add(arg)
+            if 'args' in instr:
+                for arg in instr['args']:
+                    use |= self.bit(arg)
 
-        return out
+        return (use, defs)
 
     def merge(self, cfg: data.CFG, curr_bb, out):
-        merged = set()
+        merged = 0
         for s in cfg.succ[curr_bb]:
-            for arg in list(out[s]):
-                merged.add(arg)
+            merged |= out[s]
 
         return merged
 
-    def transfer(self, instrs, input: set):
-        new_out = input.copy()
-        for instr in reversed(instrs):
-            if 'dest' in instr and instr['dest'] in new_out:
-                new_out.remove(instr['dest'])
-
-            if 'args' in instr:
-                for arg in instr['args']:
-                    new_out.add(arg)
-
-        return new_out
-
 class Defined(Analyzer):
     """Reaching definition analysis
     """
@@ -138,32 +197,22 @@ class Defined(Analyzer):
             (input, out) = self.analyze_cfg(cfg, cfg.succ)
             print_analysis(input, out)
 
-    def init_out(self, od: OrderedDict):
-        out = {}
-        for k, instrs in od.items():
-            out[k] = set()
-            for instr in instrs:
-                if 'dest' in instr:
-                    out[k].add(instr['dest'])
+    def gen_kill(self, instrs):
+        """Variables defined in the block; nothing is ever undefined."""
+        defs = 0
+        for instr in instrs:
+            if 'dest' in instr:
+                defs |= self.bit(instr['dest'])
 
-        return out
+        return (defs, 0)
 
     def merge(self, cfg: data.CFG, curr_bb, out):
-        merged = set()
+        merged = 0
         for p in cfg.pred[curr_bb]:
-            for dest in list(out[p]):
-                merged.add(dest)
+            merged |= out[p]
 
         return merged
 
-    def transfer(self, instrs, input: set):
-        new_out = input.copy()
-        for instr in instrs:
-            if 'dest' in instr:
-                new_out.add(instr['dest'])
-
-        return new_out
-
 def print_analysis(input, out):
     if len(input) != len(out):
         print("Unmatched data!")
@@ -1,5 +1,6 @@
 import sys
 import json
+import ir
 from collections import OrderedDict
 
 TERMINATORS = ["jmp", "ret", "br"]
@@ -9,49 +10,110 @@ def new_bb_name(num):
     return "b" + str(num)
 
 
+class Block:
+    """A basic block as the range instrs[start:end] of its function.
+
+    Blocks share the function's instruction list instead of copying it, and
+    the block's label lives in the name2bb key. A pass that adds or removes
+    instructions calls materialize() on the blocks it changes.
+    """
+
+    __slots__ = ("instrs", "start", "end")
+
+    def __init__(self, instrs, start, end):
+        self.instrs = instrs
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        return map(self.instrs.__getitem__, range(self.start, self.end))
+
+    def __reversed__(self):
+        return map(self.instrs.__getitem__, range(self.end - 1, self.start - 1, -1))
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            r = range(self.start, self.end)[i]
+            if r.step != 1:
+                return [self.instrs[k] for k in r]
+            return Block(self.instrs, r.start, max(r.start, r.stop))
+
+        n = self.end - self.start
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("block index out of range")
+        return self.instrs[self.start + i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def materialize(bb, name):
+    """Replace block name with its own list, so it can be edited, and return it."""
+    block = bb[name]
+    if not isinstance(block, list):
+        block = list(block)
+        bb[name] = block
+
+    return block
+
+
 # input func['instrs']
 def form_bb(instrs):
-    """Creates basic blocks within a single function."""
-    # name2bb maps basic block name to list of instructions
+    """Creates basic blocks within a single function.
+
+    Blocks are runs of instructions between labels, as Block views.
+    """
+    # name2bb maps basic block name to its instructions
     name2bb = OrderedDict()
-    num = 0
-    curr_bb = []
-    old_bb = []
     # temporary basic block name
     name = ""
+    start = 0
     for i, instr in enumerate(instrs):
-        if "label" in instr and i == 0:
-            name = instr["label"]
+        if instr.label is None:
             continue
-        elif "label" in instr and i != 0:
-            if name == "":
-                name = new_bb_name(num)
-                num += 1
-
-            old_bb = curr_bb
-            name2bb[name] = curr_bb
-            curr_bb = []
-            name = instr["label"]
-        elif instr in TERMINATORS or i == len(instrs):
-            if name == "":
-                name = new_bb_name(num)
-                num += 1
-
-            curr_bb.append(instr)
-            name2bb[name] = curr_bb
-            curr_bb = []
-        else:
-            curr_bb.append(instr)
+
+        if i == 0:
+            name = instr.label
+            start = 1
+            continue
+
+        if name == "":
+            name = new_bb_name(0)
+        name2bb[name] = Block(instrs, start, i)
+        name = instr.label
+        start = i + 1
 
     if name == "":
-        name = new_bb_name(num)
-    name2bb[name] = curr_bb
+        name = new_bb_name(0)
+    name2bb[name] = Block(instrs, start, len(instrs))
 
     return name2bb
 
 
+# input func['instrs']
+def create_bb(instrs):
+    """Creates lvn's basic blocks, which end at a terminator or a label (from l3).
+
+    Like form_bb, the blocks are views that share the instructions.
+    """
+    bb = []
+    s = 0
+    last = instrs[-1] if instrs else None
+    for i, instr in enumerate(instrs):
+        if instr == last or instr.op in TERMINATORS or instr.label is not None:
+            bb.append(Block(instrs, s, i + 1))
+            s = i + 1
+
+    return bb
+
+
 def main():
-    prog = json.load(sys.stdin)
+    prog = ir.load(json.load(sys.stdin))
     for func in prog["functions"]:
         bb = form_bb(func["instrs"])
         print(bb)
@@ -0,0 +1,111 @@
+"""Content-addressed on-disk cache of optimized functions.
+
+An entry is keyed by the canonical JSON of the input function, the pass list
+and a version hash of the pass sources, so editing any pass invalidates its
+old results. Entries are plain JSON files; reading one refreshes its mtime,
+and the least recently used files are deleted when the directory grows past
+its size limit.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bril-opt")
+DEFAULT_SIZE = 256 << 20
+
+
+def pass_version():
+    """Hash the source of every module next to this file, passes included."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    h = hashlib.sha256()
+    for name in sorted(os.listdir(here)):
+        if name.endswith(".py"):
+            with open(os.path.join(here, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+
+    return h.hexdigest()[:16]
+
+
+class Cache:
+    def __init__(self, path=DEFAULT_DIR, max_bytes=DEFAULT_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = pass_version()
+        self.hits = 0
+        self.misses = 0
+        # total size of the entries, computed on the first write
+        self.size = None
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, func, passes):
+        canon = json.dumps(func, sort_keys=True, separators=(",", ":"))
+        h = hashlib.sha256()
+        h.update(self.version.encode())
+        h.update(b"\0" + ",".join(passes).encode() + b"\0")
+        h.update(canon.encode())
+        return h.hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + ".json")
+
+    def get(self, key):
+        """Return the cached function for key, or None."""
+        path = self.entry(key)
+        try:
+            with open(path) as f:
+                func = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        # mark as recently used for eviction
+        os.utime(path)
+        self.hits += 1
+        return func
+
+    def put(self, key, func):
+        path = self.entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(func, separators=(",", ":"))
+        # write then rename, so readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """Yield (path, size, mtime) of every entry."""
+        for d in os.scandir(self.path):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if e.name.endswith(".json"):
+                    st = e.stat()
+                    yield e.path, st.st_size, st.st_mtime
+
+    def evict(self):
+        """Delete least recently used entries until 90% of the limit is left."""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)"
@@ -1,76 +1,132 @@
 import sys
 import json
 import basic_block
-from collections import OrderedDict
+import ir
+from array import array
 
 TERMINATORS = ["jmp", "ret", "br"]
 
-class CFG():
-    # predecessor
-    pred = {}
-    # successor
-    succ = {}
-    bb = OrderedDict()
+
+def terminator(bb):
+    """Index of the first terminator in bb, or None if control falls through.
+
+    Blocks only end at labels, so anything after this index is unreachable.
+    """
+    for i, instr in enumerate(bb):
+        if instr.op in TERMINATORS:
+            return i
+
+    return None
+
+
+def csr(names, ids, adj):
+    """Pack a label -> labels map into CSR offset and id arrays."""
+    off = array("i", [0])
+    idx = array("i")
+    for name in names:
+        idx.extend(ids[x] for x in adj[name])
+        off.append(len(idx))
+
+    return off, idx
+
+
+class CFG:
+    """Control flow graph over the basic blocks of one function.
+
+    Blocks are numbered 0..n-1 in layout order. Edges are stored in CSR form:
+    the successors of block i are succ_idx[succ_off[i]:succ_off[i + 1]], and
+    likewise for predecessors. names/ids map between block ids and labels, and
+    succ/pred hold the same edges as label lists for the printers.
+    """
 
     def __init__(self, bb) -> None:
-        self.pred.clear()
-        self.succ.clear()
-        self.bb.clear()
         self.bb = bb
+        # block id -> label, label -> block id
+        self.names = list(bb)
+        self.ids = {name: i for i, name in enumerate(self.names)}
         self.form_cfg()
 
+    def __len__(self):
+        return len(self.names)
+
     def last_key(self):
-        return next(reversed(self.bb))
+        return self.names[-1]
 
-    def form_cfg(self):
-        """ Forms control flow graph from a series of basic blocks.
-        """
-        for i, (k, bb) in enumerate(self.bb.items()):
-            # intialize pred map
-            self.pred[k] = []
+    def succs(self, i):
+        """Successor ids of block i."""
+        return self.succ_idx[self.succ_off[i] : self.succ_off[i + 1]]
+
+    def preds(self, i):
+        """Predecessor ids of block i."""
+        return self.pred_idx[self.pred_off[i] : self.pred_off[i + 1]]
+
+    def postorder(self):
+        """Block ids in depth-first postorder along successor edges.
 
-            if len(bb) == 0:
-                self.succ[k] = []
+        The walk starts at the entry. Blocks it cannot reach are walked from
+        afterwards in layout order, so every block is listed exactly once.
+        """
+        order = []
+        visited = bytearray(len(self.names))
+        for root in range(len(self.names)):
+            if visited[root]:
                 continue
-            else:
-                last_instr = bb[-1]
-
-            if 'op' in last_instr and last_instr['op'] in TERMINATORS:
-                match last_instr['op']:
-                    case "jmp" | "br":
-                        self.succ[k] = last_instr['labels']
-                    case "ret":
-                        self.succ[k] = []
-                    case _:
-                        print("not a terminator!")
-            else:
-                # check curr bb is not last
-                if k != self.last_key():
-                    next = list(self.bb)[i + 1]
-                    self.succ[k] = [next]
+
+            visited[root] = 1
+            stack = [(root, iter(self.succs(root)))]
+            while stack:
+                b, succ = stack[-1]
+                for s in succ:
+                    if not visited[s]:
+                        visited[s] = 1
+                        stack.append((s, iter(self.succs(s))))
+                        break
                 else:
+                    stack.pop()
+                    order.append(b)
+
+        return order
+
+    def form_cfg(self):
+        """Forms control flow graph from a series of basic blocks."""
+        names = self.names
+        self.succ = {}
+        self.pred = {k: [] for k in names}
+        for i, (k, bb) in enumerate(self.bb.items()):
+            end = terminator(bb)
+            match None if end is None else bb[end].op:
+                case "jmp" | "br":
+                    self.succ[k] = list(bb[end].labels)
+                case "ret":
                     self.succ[k] = []
+                case _:
+                    # fall through to the next block, if any, even when empty
+                    self.succ[k] = [names[i + 1]] if i + 1 < len(names) else []
 
-        for k, bbs in self.succ.items():
-            for bb in bbs:
-                self.pred[bb].append(k)
+            for s in self.succ[k]:
+                self.pred[s].append(k)
+
+        self.succ_off, self.succ_idx = csr(names, self.ids, self.succ)
+        self.pred_off, self.pred_idx = csr(names, self.ids, self.pred)
 
     def print_cfg(self):
         print("===== succesors =====")
         for k, succ in self.succ.items():
-            print(f'{k} succ: {succ}')
+            print(f"{k} succ: {succ}")
 
         print("")
         print("===== predecessors =====")
         for k, pred in self.pred.items():
-            print(f'{k} pred: {pred}')
+            print(f"{k} pred: {pred}")
+
 
 def main():
-    prog = json.load(sys.stdin)
-    for func in prog['functions']:
-        bb = basic_block.form_bb(func['instrs'])
+    prog = ir.load(json.load(sys.stdin))
+    for func in prog["functions"]:
+        bb = basic_block.form_bb(func["instrs"])
         cfg = CFG(bb)
         cfg.print_cfg()
 
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,85 @@
+"""Thin client for server.py: `python3 client.py lvn dce` filters stdin.
+
+Only the standard library is imported here, so startup stays cheap. If no
+server is listening, the passes run in this process instead.
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+
+
+def default_socket():
+    # same as server.default_socket, without importing the passes
+    name = f"bril-opt-{os.getuid()}.sock"
+    return os.environ.get("BRIL_OPT_SOCKET", os.path.join(tempfile.gettempdir(), name))
+
+
+def request(path, passes, prog, indent=None):
+    """Send a program to the server and return its reply as bytes."""
+    header = json.dumps({"passes": passes, "indent": indent})
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        try:
+            s.sendall(header.encode() + b"\n" + prog)
+            s.shutdown(socket.SHUT_WR)
+        except (BrokenPipeError, ConnectionResetError):
+            # the server stopped reading early; its reply still says why
+            pass
+        chunks = []
+        while True:
+            try:
+                chunk = s.recv(1 << 16)
+            except ConnectionResetError:
+                break
+            if not chunk:
+                break
+            chunks.append(chunk)
+
+    status, _, body = b"".join(chunks).partition(b"\n")
+    if status != b"ok":
+        print(f"server: {status.decode()}", file=sys.stderr)
+        sys.exit(1)
+
+    return body
+
+
+def main():
+    args = sys.argv[1:]
+    path = default_socket()
+    indent = None
+    if "--socket" in args:
+        i = args.index("--socket")
+        path = args[i + 1]
+        del args[i : i + 2]
+    if "--indent" in args:
+        i = args.index("--indent")
+        indent = int(args[i + 1])
+        del args[i : i + 2]
+
+    passes = [name for arg in args for name in arg.split(",")]
+    if not passes:
+        print("Usage: python3 client.py [--socket PATH] [--indent N] <pass>...")
+        sys.exit(1)
+
+    prog = sys.stdin.buffer.read()
+    try:
+        out = request(path, passes, prog, indent)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # no server: fall back to the in-process pipeline
+        import pipeline
+
+        pipeline.parse_passes(passes)
+        prog = pipeline.run_passes(json.loads(prog), passes)
+        if indent is None:
+            out = json.dumps(prog, separators=(",", ":")).encode()
+        else:
+            out = json.dumps(prog, indent=indent).encode()
+
+    sys.stdout.buffer.write(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import json
+import sys
+import basic_block
+import cfg as data
+import dfa
+import parallel
+
+
+def constprop(func):
+    """Replaces computations with a known constant result by const.
+
+    The arguments they no longer read are left for dce to remove.
+    """
+    bb = basic_block.form_bb(func["instrs"])
+    cfg = data.CFG(bb)
+    args = [arg["name"] for arg in func.get("args", [])]
+    analysis = dfa.ConstProp(cfg, args)
+    input, _ = analysis.analyze_cfg(cfg)
+
+    for b, block in enumerate(bb.values()):
+        state = dict(input[b])
+        end = data.terminator(block)
+        if end is None:
+            end = len(block) - 1
+        for i in range(end + 1):
+            instr = block[i]
+            analysis.step(state, instr)
+            if instr.dest is None or instr.op == "const":
+                continue
+            value = state.get(instr.dest, dfa.NAC)
+            if value is not dfa.NAC:
+                instr.op = "const"
+                instr.value = value
+                instr.args = None
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    prog = json.load(sys.stdin)
+    parallel.optimize(prog, constprop, jobs)
+
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
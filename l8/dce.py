@@ -0,0 +1,103 @@
+import json
+import sys
+import basic_block
+import cfg as data
+import dfa
+import parallel
+
+# definitions that must run even when their result is never used
+SIDE_EFFECTS = ["call"]
+
+
+class Optimizer:
+    def __init__(self) -> None:
+        # deleted instructions, over all rounds
+        self.removed = 0
+
+    def removable(self, instr):
+        return instr.dest is not None and instr.op not in SIDE_EFFECTS
+
+    def dead(self, instrs):
+        """Positions in instrs of pure definitions not live right after them."""
+        bb = basic_block.form_bb(instrs)
+        cfg = data.CFG(bb)
+        live = dfa.LiveIndex(cfg, self.removable)
+
+        dead = []
+        for b, block in enumerate(bb.values()):
+            for i, instr in enumerate(block):
+                if self.removable(instr) and not live.live_after(b, i, instr.dest):
+                    dead.append(block.start + i)
+
+        return dead
+
+    def dce(self, instrs):
+        # deleting a definition can make the definitions of its arguments
+        # in other blocks dead, so repeat until nothing changes
+        while True:
+            dead = self.dead(instrs)
+            if not dead:
+                return
+
+            dead = set(dead)
+            instrs[:] = [instr for i, instr in enumerate(instrs) if i not in dead]
+            self.removed += len(dead)
+
+
+def dce(func):
+    """Runs dead code elimination within one function."""
+    opt = Optimizer()
+    instrs = func["instrs"]
+    opt.dce(instrs)
+
+
+def adce(func):
+    """Aggressive dead code elimination over def-use chains.
+
+    Instructions with effects (everything without a dest, and calls) are
+    live. A live instruction makes the definitions of its arguments live,
+    found by name, so each variable's definitions are marked once and the
+    pass is linear. Everything not marked is deleted, including cycles of
+    definitions that only feed each other, like a loop counter nothing
+    reads. On SSA input a name has a single definition; otherwise all of
+    them are kept.
+    """
+    instrs = func["instrs"]
+    # variable -> positions of its definitions
+    defs = {}
+    live = bytearray(len(instrs))
+    work = []
+    for i, instr in enumerate(instrs):
+        if instr.label is not None:
+            live[i] = 1
+        elif instr.dest is None or instr.op in SIDE_EFFECTS:
+            live[i] = 1
+            work.append(i)
+        else:
+            defs.setdefault(instr.dest, []).append(i)
+
+    while work:
+        args = instrs[work.pop()].args
+        if args is None:
+            continue
+        for arg in args:
+            # pop, so the definitions of a variable are only visited once
+            for d in defs.pop(arg, ()):
+                live[d] = 1
+                work.append(d)
+
+    if not all(live):
+        instrs[:] = [instr for i, instr in enumerate(instrs) if live[i]]
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    prog = json.load(sys.stdin)
+    # optimize within one function
+    parallel.optimize(prog, adce if "--aggressive" in sys.argv else dce, jobs)
+
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,588 @@
 import sys
 import json
 import basic_block
+import ir
+import parallel
 import cfg as data
-from collections import OrderedDict
 from abc import ABC, abstractmethod
+from functools import partial
+from heapq import heapify, heappop, heappush
+from itertools import compress
+import re
 
+BITS = bytes.maketrans(b"01", b"\x00\x01")
+NONZERO = re.compile(rb"[^\x00]+")
+
+
+class Analyzer(ABC):
+    """Analyzer is a base class for specific analysis of one function.
+
+    An analysis is a lattice: top is the value nothing has flowed into yet,
+    meet() combines the values of neighbours, boundary() is what enters the
+    function (forward) or leaves it (backward), and transfer() maps a
+    block's input to its output. Values only need ==, so they can be ints,
+    dicts or anything else.
+
+    The default lattice is sets of variables as bit vectors: every variable
+    name of the function gets a bit position and a set is an int. Each
+    block's gen/kill masks are computed once, so merge and transfer are a
+    few big-int operations.
+    """
 
-class Defined:
     # Forward: 0
     # Backward: -1
+    start = 0
+    # the identity of meet
+    top = 0
 
-    def __init__(self, cfg):
+    def __init__(self, cfg, args=()):
         self.cfg = cfg
-        self.start = 0
+        # names of the function's arguments
+        self.args = list(args)
+        self.bits = {}
+        self.vars = []
+        # blocks visited by the last solve
+        self.iterations = 0
+
+    def bit(self, var):
+        """The mask of var, giving it the next free bit the first time."""
+        if var not in self.bits:
+            self.bits[var] = len(self.bits)
+            self.vars.append(var)
+
+        return 1 << self.bits[var]
+
+    def to_set(self, mask):
+        """The set of variable names whose bits are set in mask."""
+        # bin() lists bits highest first; turn '0'/'1' into 0/1 selectors
+        digits = bin(mask)[:1:-1].encode().translate(BITS)
+        return set(compress(self.vars, digits))
 
-    def init_input(self, od: OrderedDict):
-        input = {}
-        entry = list(od)[self.start]
-        input[entry] = []
+    def sparse_set(self, mask):
+        """Like to_set(), in time proportional to the nonzero bytes of mask."""
+        data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+        names = set()
+        for run in NONZERO.finditer(data):
+            for i in range(run.start(), run.end()):
+                byte = data[i]
+                while byte:
+                    low = byte & -byte
+                    names.add(self.vars[i * 8 + low.bit_length() - 1])
+                    byte ^= low
 
-        return input
+        return names
 
-    # to_update is a predecessor or successor map.
-    # If 'out' is changed, then the current basic block's pred or succ needs to be updated.
-    # Forward: succ
-    # Backward: pred
-    def analyze_cfg(self, cfg: data.CFG, to_update):
-        """A general data flow analysis solver using the worklist algorithm."""
-        input = self.init_input(cfg.bb)
-        out = self.init_out(cfg.bb)
+    def analyze_cfg(self, cfg: data.CFG):
+        """A general data flow analysis solver using the worklist algorithm.
 
-        worklist = list(cfg.bb)
+        Returns the masks flowing into and out of every block id, in the
+        direction of the analysis.
+        """
+        n = len(cfg)
+        masks = [self.gen_kill(cfg.bb[k]) for k in cfg.names]
+        # If 'out' is changed, the blocks it flows into need to be updated.
+        # Forward: merge preds, update succs
+        # Backward: merge succs, update preds
+        if self.start == 0:
+            merge_from, to_update = cfg.preds, cfg.succs
+        else:
+            merge_from, to_update = cfg.succs, cfg.preds
+
+        # Visit blocks in passes over reverse postorder for forward analyses
+        # and postorder for backward ones, so a block usually sees its inputs
+        # settled. A pass is a heap of positions in that order; a block that
+        # needs another visit joins the current pass if it comes after the
+        # block being visited and the next pass otherwise.
+        order = cfg.postorder()
+        if self.start == 0:
+            order.reverse()
+        rank = [0] * n
+        for i, b in enumerate(order):
+            rank[b] = i
+
+        input = [self.top] * n
+        out = [self.transfer(m, self.top) for m in masks]
+        # the entry block and blocks without neighbours also see what flows
+        # in from outside of the function
+        boundary = self.boundary()
+        outside = bytearray(n)
+        if boundary != self.top:
+            for b in range(n):
+                outside[b] = not merge_from(b)
+            if self.start == 0 and n:
+                outside[0] = 1
+
+        worklist = list(range(n))
+        later = []
+        queued = bytearray(b"\x01") * n
+        self.iterations = 0
         while worklist:
-            b = worklist[self.start]
-            input[b] = self.merge(cfg, b, out)
-            old = len(out[b])
-            out[b] = self.transfer(cfg.bb[b], input[b])
-
-            if old != len(out[b]):
-                for bb in to_update[b]:
-                    if bb not in worklist:
-                        worklist.append(bb)
-            else:
-                worklist.remove(b)
+            pos = heappop(worklist)
+            b = order[pos]
+            queued[b] = 0
+            self.iterations += 1
+            input[b] = self.merge(merge_from(b), out)
+            if outside[b]:
+                input[b] = self.meet(input[b], boundary)
+            old = out[b]
+            out[b] = self.transfer(masks[b], input[b])
+
+            if old != out[b]:
+                for bb in to_update(b):
+                    if not queued[bb]:
+                        queued[bb] = 1
+                        if rank[bb] > pos:
+                            heappush(worklist, rank[bb])
+                        else:
+                            later.append(rank[bb])
+
+            if not worklist:
+                worklist, later = later, []
+                heapify(worklist)
 
         return (input, out)
 
     def analyze(self):
-        (input, out) = self.analyze_cfg(self.cfg, self.cfg.succ)
-        # print_analysis(input, out)
+        """Returns maps from block label to the variable sets in and out."""
+        input, out = self.analyze_cfg(self.cfg)
+        input = {k: self.to_set(input[i]) for i, k in enumerate(self.cfg.names)}
+        out = {k: self.to_set(out[i]) for i, k in enumerate(self.cfg.names)}
         return (input, out)
 
-    def init_out(self, od: OrderedDict):
-        out = {}
-        for k, instrs in od.items():
-            out[k] = set()
+    def boundary(self):
+        return self.top
+
+    def meet(self, a, b):
+        return a | b
+
+    def merge(self, blocks, out):
+        merged = self.top
+        for b in blocks:
+            merged |= out[b]
+
+        return merged
+
+    def transfer(self, gen_kill, input):
+        gen, kill = gen_kill
+        return gen | (input & ~kill)
+
+    @abstractmethod
+    def gen_kill(self, instrs):
+        raise NotImplementedError("gen_kill() must be implemented")
+
+
+class Live(Analyzer):
+    """Live variable analysis"""
+
+    # Backward data flow analysis
+    start = -1
+
+    def gen_kill(self, instrs):
+        """Variables used before any definition in the block, and defined ones."""
+        end = data.terminator(instrs)
+        if end is not None:
+            instrs = instrs[: end + 1]
+
+        use = 0
+        defs = 0
+        for instr in reversed(instrs):
+            # Don't want to remove variable i in the following example
+            # i: int = sub i one
+            # Thus, we check dest first before adding i
+            if instr.dest is not None:
+                dest = self.bit(instr.dest)
+                use &= ~dest
+                defs |= dest
+
+            if instr.args is not None:
+                for arg in instr.args:
+                    use |= self.bit(arg)
+
+        return (use, defs)
+
+
+class Defined(Analyzer):
+    """Reaching definition analysis"""
+
+    start = 0
+
+    def gen_kill(self, instrs):
+        """Variables defined in the block; nothing is ever undefined."""
+        defs = 0
+        for instr in instrs:
+            if instr.dest is not None:
+                defs |= self.bit(instr.dest)
+
+        return (defs, 0)
+
+
+class Reaching(Analyzer):
+    """Reaching definitions over numbered definition sites.
+
+    Every instruction with a dest is a site. Sites are numbered variable by
+    variable, so the sites of one variable are a run of adjacent bits and
+    var_mask() picks them out of a set. After analyze_cfg(), before(b, i) is
+    the set of sites reaching instruction i of block id b.
+    """
+
+    start = 0
+
+    def __init__(self, cfg, args=()):
+        super().__init__(cfg, args)
+        # variable -> (block id, index) of its definitions, in layout order
+        defs = {}
+        for b, name in enumerate(cfg.names):
+            instrs = cfg.bb[name]
+            end = data.terminator(instrs)
+            if end is None:
+                end = len(instrs) - 1
+            for i in range(end + 1):
+                if instrs[i].dest is not None:
+                    defs.setdefault(instrs[i].dest, []).append((b, i))
+
+        # site -> (block id, index), and the site of each defining instruction
+        self.sites = []
+        self.site = {}
+        # variable -> (first site, number of sites)
+        self.runs = {}
+        for var, points in defs.items():
+            self.runs[var] = (len(self.sites), len(points))
+            for b, i in points:
+                self.site[id(cfg.bb[cfg.names[b]][i])] = len(self.sites)
+                self.sites.append((b, i))
+        # to_set() gives back sites
+        self.vars = self.sites
+
+        self.input = None
+        # block id -> sites reaching each instruction, built on first query
+        self.at = {}
+
+    def var_mask(self, var):
+        """The mask of all sites defining var."""
+        first, count = self.runs.get(var, (0, 0))
+        return ((1 << count) - 1) << first
+
+    def gen_kill(self, instrs):
+        """The last site of each variable defined in the block, and all
+        sites of those variables."""
+        end = data.terminator(instrs)
+        if end is not None:
+            instrs = instrs[: end + 1]
+
+        gen = 0
+        kill = 0
+        for instr in instrs:
+            if instr.dest is not None:
+                mask = self.var_mask(instr.dest)
+                gen = gen & ~mask | 1 << self.site[id(instr)]
+                kill |= mask
+
+        return (gen, kill)
+
+    def analyze_cfg(self, cfg: data.CFG):
+        self.input, out = super().analyze_cfg(cfg)
+        self.at = {}
+        return (self.input, out)
+
+    def before(self, b, i):
+        """The mask of sites reaching instruction i of block id b."""
+        if b not in self.at:
+            instrs = self.cfg.bb[self.cfg.names[b]]
+            at = [0] * len(instrs)
+            cur = self.input[b]
+            for k, instr in enumerate(instrs):
+                at[k] = cur
+                if instr.dest is not None and id(instr) in self.site:
+                    cur &= ~self.var_mask(instr.dest)
+                    cur |= 1 << self.site[id(instr)]
+            self.at[b] = at
+
+        return self.at[b][i]
+
+    def reaching(self, b, i, var):
+        """The sites of var reaching instruction i of block id b."""
+        first, count = self.runs.get(var, (0, 0))
+        mask = self.before(b, i) >> first & (1 << count) - 1
+        return tuple(first + k for k in range(count) if mask >> k & 1)
+
+
+# the constant of a variable that may hold different values
+NAC = None
+
+INT_MIN = -(1 << 63)
+
+
+def wrap(v):
+    """v as a 64-bit two's complement int, like Bril's int arithmetic."""
+    return (v - INT_MIN) % (1 << 64) + INT_MIN
+
+
+def div(a, b):
+    # Bril truncates toward zero; leave division by zero to run time
+    if b == 0:
+        return NAC
+    q = abs(a) // abs(b)
+    return wrap(q if (a < 0) == (b < 0) else -q)
+
+
+# op -> function computing the result from constant arguments
+FOLD = {
+    "add": lambda a, b: wrap(a + b),
+    "sub": lambda a, b: wrap(a - b),
+    "mul": lambda a, b: wrap(a * b),
+    "div": div,
+    "eq": lambda a, b: a == b,
+    "lt": lambda a, b: a < b,
+    "gt": lambda a, b: a > b,
+    "le": lambda a, b: a <= b,
+    "ge": lambda a, b: a >= b,
+    "not": lambda a: not a,
+    "and": lambda a, b: a and b,
+    "or": lambda a, b: a or b,
+    "id": lambda a: a,
+}
+
+
+class ConstProp(Analyzer):
+    """Constant propagation
+
+    A value maps each variable to its constant, or to NAC when it can hold
+    different values. A variable that is missing has not been defined on
+    any path seen so far.
+    """
+
+    start = 0
+    top = {}
+
+    def boundary(self):
+        # nothing is known about the function's arguments
+        return {arg: NAC for arg in self.args}
+
+    def meet(self, a, b):
+        merged = dict(a)
+        for var, v in b.items():
+            if merged.get(var, v) != v:
+                merged[var] = NAC
+            else:
+                merged[var] = v
+
+        return merged
+
+    def merge(self, blocks, out):
+        merged = self.top
+        for b in blocks:
+            merged = self.meet(merged, out[b])
+
+        return merged
+
+    def gen_kill(self, instrs):
+        """The instructions that run; transfer() interprets them."""
+        end = data.terminator(instrs)
+        if end is not None:
+            instrs = instrs[: end + 1]
+
+        return instrs
+
+    def transfer(self, instrs, input):
+        state = dict(input)
+        for instr in instrs:
+            self.step(state, instr)
+
+        return state
+
+    def step(self, state, instr):
+        """Update state to right after instr."""
+        dest = instr.dest
+        if dest is None:
+            return
+        if instr.op == "const":
+            state[dest] = instr.value
+            return
+
+        fold = FOLD.get(instr.op)
+        if fold is None:
+            state[dest] = NAC
+            return
+
+        if any(arg not in state for arg in instr.args):
+            # an argument is still undefined, so is the result
+            state.pop(dest, None)
+            return
+
+        values = [state[arg] for arg in instr.args]
+        state[dest] = NAC if NAC in values else fold(*values)
+
+    def to_set(self, state):
+        return state
+
+
+# ops whose result only depends on their arguments, and which are worth
+# reusing instead of recomputing
+REUSABLE = [
+    "add",
+    "sub",
+    "mul",
+    "div",
+    "eq",
+    "lt",
+    "gt",
+    "le",
+    "ge",
+    "not",
+    "and",
+    "or",
+    "fadd",
+    "fsub",
+    "fmul",
+    "fdiv",
+    "feq",
+    "flt",
+    "fgt",
+    "fle",
+    "fge",
+    "ptradd",
+]
+
+COMMUTATIVE = ["add", "mul", "eq", "and", "or", "fadd", "fmul", "feq"]
+
+
+class Available(Analyzer):
+    """Available expression analysis
+
+    An element is a computation "dest = op args" of the function. It is
+    available at a point if every path there runs it and then redefines
+    neither dest nor an argument, so dest still holds its result.
+    """
+
+    start = 0
+
+    def __init__(self, cfg, args=()):
+        super().__init__(cfg, args)
+        # variable -> mask of the elements that read or write it
+        self.uses = {}
+        # "op args" -> mask of the elements computing it
+        self.same = {}
+        # element -> the variable holding its result
+        self.dests = []
+        for name in cfg.names:
+            instrs = cfg.bb[name]
+            end = data.terminator(instrs)
+            if end is not None:
+                instrs = instrs[: end + 1]
             for instr in instrs:
-                if "dest" in instr:
-                    out[k].add(instr["dest"])
+                expr = self.expr(instr)
+                if expr is None:
+                    continue
+                key = f"{instr.dest} = {expr}"
+                if key not in self.bits:
+                    self.dests.append(instr.dest)
+                bit = self.bit(key)
+                self.same[expr] = self.same.get(expr, 0) | bit
+                for var in instr.args + [instr.dest]:
+                    self.uses[var] = self.uses.get(var, 0) | bit
+
+        # every element, before anything is known
+        self.top = (1 << len(self.vars)) - 1
+
+    def expr(self, instr):
+        """The computation of instr as a string, or None if not reusable."""
+        if instr.dest is None or instr.op not in REUSABLE:
+            return None
+        if instr.dest in instr.args:
+            # redefines its own argument, so never holds afterwards
+            return None
+
+        args = instr.args
+        if instr.op in COMMUTATIVE:
+            args = sorted(args)
+        return " ".join([instr.op] + args)
 
-        return out
+    def boundary(self):
+        return 0
 
-    def merge(self, cfg: data.CFG, curr_bb, out):
-        merged = set()
-        for p in cfg.pred[curr_bb]:
-            for dest in list(out[p]):
-                merged.add(dest)
+    def meet(self, a, b):
+        return a & b
+
+    def merge(self, blocks, out):
+        merged = self.top
+        for b in blocks:
+            merged &= out[b]
 
         return merged
 
-    def transfer(self, instrs, input: set):
-        new_out = input.copy()
+    def gen_kill(self, instrs):
+        """Elements computed in the block and still holding at its end, and
+        elements reading or writing a variable the block defines."""
+        end = data.terminator(instrs)
+        if end is not None:
+            instrs = instrs[: end + 1]
+
+        gen = 0
+        kill = 0
         for instr in instrs:
-            if "dest" in instr:
-                new_out.add(instr["dest"])
+            if instr.dest is not None:
+                mask = self.uses.get(instr.dest, 0)
+                gen &= ~mask
+                kill |= mask
+                expr = self.expr(instr)
+                if expr is not None:
+                    gen |= 1 << self.bits[f"{instr.dest} = {expr}"]
+
+        return (gen, kill)
+
 
-        return new_out
+class LiveIndex:
+    """Answers "is v live after instruction i of block b" from Live's results.
+
+    One backward pass per block, starting from the block's live-out, records
+    the live set after every instruction as a mask, so a query is a list
+    lookup and a bit test. Instructions after a block's terminator are
+    unreachable and have nothing live after them.
+
+    removable(instr), if given, marks definitions that would be deleted when
+    their result is dead. Their arguments are not counted as uses then, so a
+    chain of dead definitions within a block is found in one pass.
+    """
+
+    def __init__(self, cfg, removable=None):
+        self.cfg = cfg
+        self.live = Live(cfg)
+        # backward: the merged input of a block is its live-out
+        live_out, _ = self.live.analyze_cfg(cfg)
+        # Live interned every variable of the reachable instructions
+        bits = self.live.bits
+
+        # block id -> mask of the variables live after each instruction
+        self.after = []
+        for b, name in enumerate(cfg.names):
+            instrs = cfg.bb[name]
+            end = data.terminator(instrs)
+            if end is None:
+                end = len(instrs) - 1
+
+            after = [0] * len(instrs)
+            live = live_out[b]
+            for i in range(end, -1, -1):
+                after[i] = live
+                instr = instrs[i]
+                if instr.dest is not None:
+                    dest = 1 << bits[instr.dest]
+                    if not live & dest and removable and removable(instr):
+                        continue
+                    live &= ~dest
+                if instr.args is not None:
+                    for arg in instr.args:
+                        live |= 1 << bits[arg]
+            self.after.append(after)
+
+    def live_after(self, b, i, var):
+        """Whether var is live right after instruction i of block id b."""
+        pos = self.live.bits.get(var)
+        return pos is not None and self.after[b][i] >> pos & 1 == 1
+
+    def live_set(self, b, i):
+        """The variables live right after instruction i of block id b."""
+        return self.live.to_set(self.after[b][i])
 
 
 def print_analysis(input, out):
@@ -95,15 +602,47 @@ def fmt(val):
             return ", ".join(sorted(val))
         else:
             return "∅"
+    if isinstance(val, dict):
+        if val:
+            return ", ".join(
+                f"{k}: {'?' if v is NAC else json.dumps(v)}"
+                for k, v in sorted(val.items())
+            )
+        else:
+            return "∅"
+
+
+ANALYSES = {
+    "live": Live,
+    "defined": Defined,
+    "const": ConstProp,
+    "available": Available,
+}
+
+
+def report(func, analysis):
+    """Print the analysis of one function."""
+    bb = basic_block.form_bb(func["instrs"])
+    cfg = data.CFG(bb)
+    args = [arg["name"] for arg in func.get("args", [])]
+    input, out = ANALYSES[analysis](cfg, args).analyze()
+    if analysis == "live":
+        # We need to swap input and out because we're analyzing in backwards.
+        print_analysis(out, input)
+    else:
+        print_analysis(input, out)
 
 
 def main():
+    args = sys.argv
+    jobs = parallel.parse_jobs(args)
+    if len(args) < 2 or args[1] not in ANALYSES:
+        print(f"Usage: python3 dfa.py <{'|'.join(ANALYSES)}>")
+        sys.exit(1)
+
     prog = json.load(sys.stdin)
-    for func in prog["functions"]:
-        bb = basic_block.form_bb(func["instrs"])
-        cfg = data.CFG(bb)
-        defined = Defined(cfg)
-        defined.analyze()
+    fn = partial(ir.apply, partial(report, analysis=args[1]))
+    parallel.print_funcs(fn, prog["functions"], jobs)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
 import sys
 import json
-import copy
 import basic_block
+import ir
+import parallel
 import logging
-import resource
 import cfg as data
+from array import array
 from collections import OrderedDict
-from treelib import Node, Tree
+from functools import partial
+from treelib import Tree
 from subprocess import check_call
 
 
@@ -118,52 +120,6 @@ def form_tree(root, remain, tree, cfg: data.CFG):
             form_tree(node, remain, tree, cfg)
 
 
-def form_tree_v2(root, nodes, tree, cfg: data.CFG):
-    """Form a tree"""
-    if nodes is []:
-        return tree
-
-    remain = copy.deepcopy(nodes)
-    added = set()
-
-    for node in nodes:
-        # immediate dominators of node
-        idom = cfg.succ[node]
-
-        common = []
-        for n in idom:
-            if n not in tree[node] and n not in added:
-                tree[node].add(n)
-                added.add(n)
-
-            common.append(cfg.succ[n])
-
-        if len(common) < 2:
-            continue
-
-        result = set(common[0])
-        for c in common[1:]:
-            result.intersection_update(c)
-
-        for n in result:
-            if n not in tree[node] and n not in added:
-                tree[node].add(n)
-                added.add(n)
-
-
-def get_dom_tree_v2(dom, cfg: data.CFG):
-    # block -> children
-    tree = OrderedDict()
-    nodes = list(cfg.bb)
-    for node in nodes:
-        tree[node] = set()
-
-    root = nodes[0]
-    form_tree_v2(root, nodes, tree, cfg)
-
-    return tree
-
-
 def get_dom_tree(dom, cfg: data.CFG):
     """A dominator tree is a tree where each node's children are those
     nodes it immediately dominates. The start node is the root of the tree.
@@ -184,30 +140,31 @@ def get_dom_tree(dom, cfg: data.CFG):
     return tree
 
 
-def intersect(sets):
-    """From bril example"""
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
-    return out
+def bits(mask):
+    """Yield the indices of the set bits of mask, lowest first."""
+    # bin() is linear in the width of mask, unlike repeated big-int masking
+    digits = bin(mask)[:1:-1]
+    i = digits.find("1")
+    while i >= 0:
+        yield i
+        i = digits.find("1", i + 1)
 
 
 def get_dom_v2(cfg: data.CFG):
-    """From bril example"""
-    nodes = list(cfg.bb)
-    pred = cfg.pred
-    succ = cfg.succ
-    dom = {v: set(nodes) for v in succ}
+    """From bril example, over block ids with a bit set per block"""
+    n = len(cfg)
+    preds = [cfg.preds(i) for i in range(n)]
+    full = (1 << n) - 1
+    dom = [full] * n
 
     while True:
         changed = False
 
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
+        for node in range(n):
+            new_dom = full if preds[node] else 0
+            for p in preds[node]:
+                new_dom &= dom[p]
+            new_dom |= 1 << node
 
             if dom[node] != new_dom:
                 dom[node] = new_dom
@@ -216,7 +173,332 @@ def get_dom_v2(cfg: data.CFG):
         if not changed:
             break
 
-    return dom
+    names = cfg.names
+    return {names[v]: {names[i] for i in bits(mask)} for v, mask in enumerate(dom)}
+
+
+def get_idom_iterative(cfg: data.CFG):
+    """Immediate dominators, by Cooper, Harvey and Kennedy's "A Simple, Fast
+    Dominance Algorithm".
+
+    Blocks reachable from the entry are numbered in postorder, so a
+    dominator always has a higher number than the blocks it dominates and
+    intersect() walks two fingers up the tree towards the larger one.
+
+    output: list[block id] -> id of its immediate dominator, -1 for the
+    entry and for unreachable blocks
+    """
+    order = cfg.postorder()
+    # the walk from the entry comes first and ends with the entry
+    k = order.index(0) + 1 if order else 0
+    order = order[:k]
+    num = [-1] * len(cfg)
+    for i, b in enumerate(order):
+        num[b] = i
+    preds = [[num[p] for p in cfg.preds(b) if num[p] >= 0] for b in order]
+
+    # postorder number -> postorder number of its idom, -1 while unknown
+    doms = [-1] * k
+    if k:
+        doms[k - 1] = k - 1
+
+    changed = True
+    while changed:
+        changed = False
+        # reverse postorder, skipping the entry
+        for i in range(k - 2, -1, -1):
+            new = -1
+            for p in preds[i]:
+                if doms[p] == -1:
+                    continue
+                if new == -1:
+                    new = p
+                    continue
+                # intersect
+                a = p
+                while a != new:
+                    while a < new:
+                        a = doms[a]
+                    while new < a:
+                        new = doms[new]
+
+            if doms[i] != new:
+                doms[i] = new
+                changed = True
+
+    idom = [-1] * len(cfg)
+    for i in range(k - 1):
+        idom[order[i]] = order[doms[i]]
+
+    return idom
+
+
+def get_idom_snca(cfg: data.CFG):
+    """Immediate dominators, by the semi-NCA variant of Lengauer and Tarjan.
+
+    Blocks reachable from the entry are numbered in DFS preorder. Going
+    backwards through that order, each block's semidominator is the least
+    semidominator found on the compressed paths from its predecessors. An
+    idom is then the nearest common ancestor of the DFS parent and the
+    semidominator, found by walking up the idoms already computed.
+
+    output: same as get_idom_iterative
+    """
+    n = len(cfg)
+    # block id -> preorder number, and back
+    pre = [-1] * n
+    vertex = []
+    # preorder number -> preorder number of the DFS parent
+    parent = []
+    if n:
+        pre[0] = 0
+        vertex.append(0)
+        parent.append(0)
+        stack = [(0, iter(cfg.succs(0)))]
+        while stack:
+            b, succ = stack[-1]
+            for s in succ:
+                if pre[s] == -1:
+                    pre[s] = len(vertex)
+                    vertex.append(s)
+                    parent.append(pre[b])
+                    stack.append((s, iter(cfg.succs(s))))
+                    break
+            else:
+                stack.pop()
+
+    k = len(vertex)
+    semi = list(range(k))
+    label = list(range(k))
+    # the link forest; a node is linked once its number is >= last
+    ancestor = parent[:]
+
+    def least(v, last):
+        """The label with the least semidominator on the linked path from v."""
+        if ancestor[v] < last:
+            return label[v]
+
+        path = []
+        while ancestor[v] >= last:
+            path.append(v)
+            v = ancestor[v]
+        # compress the path onto its top, carrying the best label down
+        top = v
+        while path:
+            v = path.pop()
+            if semi[label[top]] < semi[label[v]]:
+                label[v] = label[top]
+            ancestor[v] = ancestor[top]
+            top = v
+
+        return label[v]
+
+    for w in range(k - 1, 0, -1):
+        semi[w] = parent[w]
+        for p in cfg.preds(vertex[w]):
+            v = pre[p]
+            if v == -1:
+                continue
+            u = semi[least(v, w + 1)]
+            if u < semi[w]:
+                semi[w] = u
+
+    # preorder number -> preorder number of its idom
+    doms = parent[:]
+    for w in range(1, k):
+        d = doms[w]
+        while d > semi[w]:
+            d = doms[d]
+        doms[w] = d
+
+    idom = [-1] * n
+    for w in range(1, k):
+        idom[vertex[w]] = vertex[doms[w]]
+
+    return idom
+
+
+# engine name -> function computing immediate dominators
+ENGINES = {"iterative": get_idom_iterative, "snca": get_idom_snca}
+# the default engine. "auto" is semi-NCA: in dombench.py it was at least as
+# fast as the iterative engine at every size tried, 2 to 50000 blocks, so
+# there is no crossover for the CFG size to choose by
+ENGINE = "auto"
+
+
+def parse_engine(argv):
+    """Remove "--engine NAME" from argv and make NAME the default engine."""
+    global ENGINE
+    for i, arg in enumerate(argv):
+        if arg == "--engine":
+            if i + 1 >= len(argv) or argv[i + 1] not in ["auto", *ENGINES]:
+                print(f"--engine needs one of: auto, {', '.join(ENGINES)}")
+                sys.exit(1)
+            ENGINE = argv[i + 1]
+            del argv[i : i + 2]
+            return
+
+
+def set_engine(engine):
+    """Make engine the default; also the pool initializer of the scripts."""
+    global ENGINE
+    ENGINE = engine
+
+
+def get_idom(cfg: data.CFG, engine=None):
+    """Immediate dominators, with the engine named by engine or ENGINE."""
+    engine = engine or ENGINE
+    if engine == "auto":
+        engine = "snca"
+
+    return ENGINES[engine](cfg)
+
+
+class Dominators:
+    """The dominator tree of one function, over block ids.
+
+    Everything is an array indexed by block id: idom[b] is the parent of b
+    (-1 for the entry and unreachable blocks, which are roots), depth[b] its
+    distance from a root, and pre[b]/post[b] the steps at which a DFS of the
+    tree enters and leaves b. a dominates b iff b's interval lies in a's, so
+    dominates() is two comparisons and no dominator set is ever stored.
+
+    Dominator sets, the label-keyed tree and dominance frontiers are derived
+    when asked for, in the shapes of get_dom_v2 and get_dom_front_v2.
+    """
+
+    def __init__(self, cfg: data.CFG, engine=None):
+        self.cfg = cfg
+        self.idom = get_idom(cfg, engine)
+        n = len(cfg)
+        # dominance frontiers, formed on first use
+        self.front_off = None
+        self.front_idx = None
+
+        # children of block b are child_idx[child_off[b] : child_off[b + 1]]
+        self.child_off = array("i", [0]) * (n + 1)
+        for parent in self.idom:
+            if parent != -1:
+                self.child_off[parent + 1] += 1
+        for b in range(n):
+            self.child_off[b + 1] += self.child_off[b]
+        self.child_idx = array("i", [0]) * self.child_off[n]
+        fill = self.child_off[:n]
+        for b, parent in enumerate(self.idom):
+            if parent != -1:
+                self.child_idx[fill[parent]] = b
+                fill[parent] += 1
+
+        self.depth = array("i", [0]) * n
+        self.pre = array("i", [0]) * n
+        self.post = array("i", [0]) * n
+        step = 0
+        for root in range(n):
+            if self.idom[root] != -1:
+                continue
+
+            self.pre[root] = step
+            step += 1
+            stack = [(root, iter(self.children(root)))]
+            while stack:
+                b, kids = stack[-1]
+                for c in kids:
+                    self.depth[c] = self.depth[b] + 1
+                    self.pre[c] = step
+                    step += 1
+                    stack.append((c, iter(self.children(c))))
+                    break
+                else:
+                    stack.pop()
+                    self.post[b] = step
+                    step += 1
+
+    def children(self, b):
+        """Ids of the blocks b immediately dominates."""
+        return self.child_idx[self.child_off[b] : self.child_off[b + 1]]
+
+    def dominates(self, a, b):
+        """Whether block id a dominates block id b."""
+        return self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]
+
+    def sets(self):
+        """map[block] -> block's dominators"""
+        names = self.cfg.names
+        dom = [None] * len(names)
+        # an idom comes before the blocks it dominates in reverse postorder
+        for b in reversed(self.cfg.postorder()):
+            parent = self.idom[b]
+            dom[b] = {names[b]} if parent == -1 else dom[parent] | {names[b]}
+
+        return {names[b]: dom[b] for b in range(len(names))}
+
+    def tree(self):
+        """map[block] -> blocks it immediately dominates"""
+        names = self.cfg.names
+        return OrderedDict(
+            (name, {names[c] for c in self.children(b)}) for b, name in enumerate(names)
+        )
+
+    def frontier(self, b):
+        """Ids of the blocks in the dominance frontier of block id b, in
+        layout order."""
+        if self.front_off is None:
+            self.form_frontiers()
+        return self.front_idx[self.front_off[b] : self.front_off[b + 1]]
+
+    def form_frontiers(self):
+        """Dominance frontiers of every block, by Cooper, Harvey and
+        Kennedy's walk up the tree.
+
+        Only a block with several predecessors is in any frontier. The entry
+        also has an edge from the start of the function, so it counts as one
+        as soon as some block jumps to it. A join is in the frontier of each
+        block on the way up from a predecessor to its own idom. The
+        frontiers are stored in CSR form like children.
+        """
+        cfg = self.cfg
+        idom = self.idom
+        n = len(cfg)
+        reachable = [b == 0 or d != -1 for b, d in enumerate(idom)]
+        # (block, member of its frontier) pairs; last[x] is the latest join
+        # added to x's frontier, which ends a walk that already went this way
+        owner = array("i")
+        member = array("i")
+        last = [-1] * n
+        for b in range(n):
+            preds = cfg.preds(b)
+            # the entry's edge from the function start comes from above the
+            # tree, so it needs no walk
+            if len(preds) + (b == 0) < 2 or not reachable[b]:
+                continue
+
+            for runner in preds:
+                if not reachable[runner]:
+                    continue
+                while runner != idom[b] and last[runner] != b:
+                    last[runner] = b
+                    owner.append(runner)
+                    member.append(b)
+                    runner = idom[runner]
+
+        self.front_off = array("i", [0]) * (n + 1)
+        for x in owner:
+            self.front_off[x + 1] += 1
+        for x in range(n):
+            self.front_off[x + 1] += self.front_off[x]
+        self.front_idx = array("i", [0]) * len(member)
+        fill = self.front_off[:n]
+        # members were found in increasing order, so every frontier is sorted
+        for x, b in zip(owner, member):
+            self.front_idx[fill[x]] = b
+            fill[x] += 1
+
+    def frontiers(self):
+        """map[block] -> block's dom frontiers, in layout order"""
+        names = self.cfg.names
+        return OrderedDict(
+            (name, [names[f] for f in self.frontier(b)]) for b, name in enumerate(names)
+        )
 
 
 def get_dom(cfg: data.CFG):
@@ -330,39 +612,44 @@ def print_dom(dom):
         print(f"{k}: {v}")
 
 
+def analyze(func, mode):
+    """Print the dominator information selected by mode for one function."""
+    func_name = func["name"]
+    logging.debug(f"==========func name: {func_name}=========")
+    bb = basic_block.form_bb(func["instrs"])
+    cfg = data.CFG(bb)
+    if mode == "dom":
+        dom = Dominators(cfg).sets()
+        # dom = get_dom(cfg)
+        test_dom(dom, cfg)
+        print_dom(dom)
+    elif mode == "tree":
+        tree = Dominators(cfg).tree()
+        for k, v in tree.items():
+            print(f"{k}: {v}")
+        # Disable draw
+        # draw_dom_tree(tree, func_name)
+    elif mode == "front":
+        front = Dominators(cfg).frontiers()
+        # test_dom_front(dom, front, cfg)
+        for k, v in front.items():
+            print(f"{k}: {v}")
+    else:
+        print("unknown arg")
+        exit(1)
+
+
 def main():
     args = sys.argv
+    jobs = parallel.parse_jobs(args)
+    parse_engine(args)
     logging.basicConfig(stream=sys.stderr, level=logging.ERROR)
 
     prog = json.load(sys.stdin)
-    for func in prog["functions"]:
-        func_name = func["name"]
-        logging.debug(f"==========func name: {func_name}=========")
-        bb = basic_block.form_bb(func["instrs"])
-        cfg = data.CFG(bb)
-        if len(args) > 1:
-            if args[1] == "dom":
-                dom = get_dom_v2(cfg)
-                # dom = get_dom(cfg)
-                test_dom(dom, cfg)
-                print_dom(dom)
-            elif args[1] == "tree":
-                dom = get_dom(cfg)
-                tree = get_dom_tree_v2(dom, cfg)
-                for k, v in tree.items():
-                    print(f"{k}: {v}")
-                # Disable draw
-                # draw_dom_tree(tree, func_name)
-            elif args[1] == "front":
-                dom = get_dom_v2(cfg)
-                # front = get_dom_front(dom, cfg)
-                front = get_dom_front_v2(dom, cfg)
-                # test_dom_front(dom, front, cfg)
-                for k, v in front.items():
-                    print(f"{k}: {v}")
-            else:
-                print("unknown arg")
-                exit(1)
+    if len(args) > 1:
+        report = partial(ir.apply, partial(analyze, mode=args[1]))
+        init = partial(set_engine, ENGINE)
+        parallel.print_funcs(report, prog["functions"], jobs, init)
 
     # json.dump(prog, sys.stdout, indent=2)
 
@@ -0,0 +1,131 @@
+"""Time the dominator engines and dominance frontiers on synthetic CFGs.
+
+    python3 dombench.py [blocks ...]
+
+Every CFG is a chain of blocks where each block also branches to one other
+block. In the "loops" shape that is a random nearby block ahead or, less
+often, back to an earlier one, so there are many joins and nested loops.
+In the "irregular" shape it is any block of the function, which gives
+irreducible control flow and deep dominator trees. The "nested" shape is
+one loop nest as deep as half the blocks.
+
+The first table times get_dom_v2 and both get_idom engines on the same CFG,
+the second the frontiers of get_dom_front_v2 and of Dominators, each
+starting from the CFG. Results are compared, and times are per call, in
+milliseconds.
+"""
+
+import random
+import sys
+import time
+
+import basic_block
+import cfg as data
+import dom as dominator
+import ir
+
+SIZES = [10, 100, 1000, 5000, 10000, 20000]
+# get_dom_front_v2 is quadratic, so it gets smaller CFGs by default
+FRONT_SIZES = [10, 100, 1000, 2500, 5000]
+# blocks timed per engine and CFG, so small CFGs run many times
+WORK = 20000
+
+
+def loops(rng, i, n):
+    # back edges never reach the entry, see irregular()
+    if i > 0 and rng.random() < 0.2:
+        return rng.randint(max(1, i - 50), i)
+    return rng.randint(i + 1, min(n - 1, i + 50))
+
+
+def irregular(rng, i, n):
+    # not the entry, which get_dom_v2 expects to have no predecessors
+    return rng.randrange(1, n)
+
+
+def nested(rng, i, n):
+    # the first half are loop headers, the second half their latches,
+    # innermost first
+    if i < n // 2:
+        return i + 1
+    return n - 1 - i
+
+
+SHAPES = {"loops": loops, "irregular": irregular, "nested": nested}
+
+
+def synthetic(n, seed=0, shape=loops):
+    """The instructions of a function with n blocks."""
+    rng = random.Random(seed)
+    instrs = [
+        ir.Instr(label="b0"),
+        ir.Instr("const", "cond", "bool", value=True),
+    ]
+    for i in range(n - 1):
+        target = shape(rng, i, n)
+        instrs.append(ir.Instr("br", args=["cond"], labels=[f"b{i + 1}", f"b{target}"]))
+        instrs.append(ir.Instr(label=f"b{i + 1}"))
+    instrs.append(ir.Instr("ret"))
+
+    return instrs
+
+
+def timed(fn, cfg):
+    """fn(cfg) and the seconds one call takes."""
+    runs = max(1, WORK // len(cfg))
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = fn(cfg)
+    return result, (time.perf_counter() - start) / runs
+
+
+def frontiers_v2(cfg):
+    return dominator.get_dom_front_v2(dominator.get_dom_v2(cfg), cfg)
+
+
+def frontiers(cfg):
+    return dominator.Dominators(cfg).frontiers()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or SIZES
+    print(
+        f"{'shape':>10} {'blocks':>8} {'get_dom_v2':>12} {'iterative':>12} {'snca':>12}"
+    )
+    for name, shape in SHAPES.items():
+        for n in sizes:
+            cfg = data.CFG(basic_block.form_bb(synthetic(n, shape=shape)))
+            v2, v2_time = timed(dominator.get_dom_v2, cfg)
+            idom, iterative_time = timed(dominator.get_idom_iterative, cfg)
+            snca, snca_time = timed(dominator.get_idom_snca, cfg)
+            if snca != idom:
+                print(f"{name}, {n} blocks: engines differ")
+                sys.exit(1)
+            if dominator.Dominators(cfg, "snca").sets() != v2:
+                print(f"{name}, {n} blocks: dominator sets differ")
+                sys.exit(1)
+
+            print(
+                f"{name:>10} {n:>8} {v2_time * 1000:>10.3f}ms"
+                f" {iterative_time * 1000:>10.3f}ms {snca_time * 1000:>10.3f}ms"
+            )
+
+    print()
+    print(f"{'shape':>10} {'blocks':>8} {'front_v2':>12} {'frontiers':>12}")
+    for name, shape in SHAPES.items():
+        for n in [int(arg) for arg in sys.argv[1:]] or FRONT_SIZES:
+            cfg = data.CFG(basic_block.form_bb(synthetic(n, shape=shape)))
+            v2, v2_time = timed(frontiers_v2, cfg)
+            front, front_time = timed(frontiers, cfg)
+            if any(set(v2[k]) != set(front[k]) for k in front):
+                print(f"{name}, {n} blocks: frontiers differ")
+                sys.exit(1)
+
+            print(
+                f"{name:>10} {n:>8} {v2_time * 1000:>10.3f}ms"
+                f" {front_time * 1000:>10.3f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import json
+import sys
+import basic_block
+import cfg as data
+import dfa
+import parallel
+
+
+def gcse(func):
+    """Global common subexpression elimination.
+
+    A computation that is available on entry to its block is replaced by a
+    copy of the variable holding it, or deleted when that variable is its
+    own dest. lvn and dce then clean up the copies.
+    """
+    instrs = func["instrs"]
+    bb = basic_block.form_bb(instrs)
+    cfg = data.CFG(bb)
+    analysis = dfa.Available(cfg)
+    input, _ = analysis.analyze_cfg(cfg)
+
+    redundant = set()
+    for b, block in enumerate(bb.values()):
+        # elements available on entry and not killed yet; redundancy within
+        # the block is left to lvn
+        avail = input[b]
+        end = data.terminator(block)
+        if end is None:
+            end = len(block) - 1
+        for i in range(end + 1):
+            instr = block[i]
+            expr = analysis.expr(instr)
+            same = avail & analysis.same[expr] if expr is not None else 0
+            if instr.dest is not None:
+                avail &= ~analysis.uses.get(instr.dest, 0)
+            if not same:
+                continue
+
+            # any element computing it will do; take the first one
+            var = analysis.dests[(same & -same).bit_length() - 1]
+            if var == instr.dest:
+                redundant.add(block.start + i)
+            else:
+                instr.op = "id"
+                instr.args = [var]
+
+    if redundant:
+        instrs[:] = [instr for i, instr in enumerate(instrs) if i not in redundant]
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    prog = json.load(sys.stdin)
+    parallel.optimize(prog, gcse, jobs)
+
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
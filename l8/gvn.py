@@ -0,0 +1,146 @@
+import json
+import sys
+import basic_block
+import cfg as data
+import dom as dominator
+import lvn
+import parallel
+from functools import partial
+
+# ops create_tup describes that must run every time
+IMPURE = ["call", "print"]
+
+
+class GVN(lvn.Optimizer):
+    """Global value numbering over SSA form.
+
+    create_tup still describes an instruction by its op and the value
+    numbers of its arguments, commutative ones sorted, but the table now
+    outlives a block: the walk over the dominator tree adds a block's
+    expressions, visits the blocks it dominates, and drops them again, so a
+    block only sees the expressions of its dominators. Every variable is
+    defined once, so var2num is never undone.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # value number -> the variable holding it first, which dominates
+        # every other variable with that number
+        self.leader = {}
+        # table keys in the order they were added
+        self.log = []
+        # computations turned into copies
+        self.replaced = 0
+
+    def number(self, var):
+        """Give var a value number of its own."""
+        num = "v" + str(self.local_num)
+        self.local_num += 1
+        self.var2num[var] = num
+        self.leader[num] = var
+        return num
+
+    def visit(self, block, entry=False):
+        for instr in block:
+            dest = instr.dest
+            if dest is None:
+                continue
+
+            if instr.op == "id" and instr.args[0] in self.var2num:
+                self.var2num[dest] = self.var2num[instr.args[0]]
+                continue
+
+            if instr.op == "phi":
+                # the same value from every predecessor; its leader dominates
+                # all of them, and so this block unless it is the entry
+                nums = {self.var2num.get(arg) for arg in instr.args}
+                if len(nums) == 1 and None not in nums and not entry:
+                    self.var2num[dest] = nums.pop()
+                else:
+                    self.number(dest)
+                continue
+
+            tup = () if instr.op in IMPURE else self.create_tup(instr)
+            if not tup:
+                self.number(dest)
+                continue
+
+            if tup in self.table:
+                num, var, type = self.table[tup]
+                if type == instr.type:
+                    self.var2num[dest] = num
+                    instr.op = "id"
+                    instr.args = [var]
+                    instr.value = None
+                    self.replaced += 1
+                else:
+                    self.number(dest)
+                continue
+
+            self.table[tup] = self.number(dest), dest, instr.type
+            self.log.append(tup)
+
+    def walk(self, bb, cfg, dom):
+        """Number every block, each with the table of its dominators."""
+        names = cfg.names
+        for root in range(len(cfg)):
+            if dom.idom[root] != -1:
+                continue
+
+            # (block id, log length on entry, or -1 before entering)
+            work = [(root, -1)]
+            while work:
+                b, mark = work.pop()
+                if mark >= 0:
+                    while len(self.log) > mark:
+                        del self.table[self.log.pop()]
+                    continue
+
+                work.append((b, len(self.log)))
+                self.visit(bb[names[b]], b == 0)
+                for c in reversed(dom.children(b)):
+                    work.append((c, -1))
+
+    def rewrite(self, instrs):
+        """Make every use read the leader of its value."""
+        for instr in instrs:
+            if instr.args is None:
+                continue
+            for i, arg in enumerate(instr.args):
+                num = self.var2num.get(arg)
+                if num is not None:
+                    instr.args[i] = self.leader[num]
+
+
+def gvn(func):
+    """Runs global value numbering on a function in SSA form.
+
+    Functions that assign a variable twice are left alone. The copies it
+    leaves behind are dead, for dce or adce to remove.
+    """
+    instrs = func["instrs"]
+    args = [arg["name"] for arg in func.get("args", [])]
+    dests = [instr.dest for instr in instrs if instr.dest is not None]
+    if len(set(dests) | set(args)) != len(dests) + len(args):
+        return
+
+    bb = basic_block.form_bb(instrs)
+    cfg = data.CFG(bb)
+    dom = dominator.Dominators(cfg)
+    opt = GVN()
+    for arg in args:
+        opt.number(arg)
+    opt.walk(bb, cfg, dom)
+    opt.rewrite(instrs)
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    dominator.parse_engine(sys.argv)
+    prog = json.load(sys.stdin)
+    parallel.optimize(prog, gvn, jobs, partial(dominator.set_engine, dominator.ENGINE))
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
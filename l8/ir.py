@@ -0,0 +1,132 @@
+"""Compact instruction representation shared by the passes.
+
+Bril JSON gives every instruction its own dict, and the passes keep probing
+those dicts with string keys. Instr stores the same fields in __slots__, so
+`"op" in instr` becomes `instr.op is not None` and `instr["args"]` becomes
+`instr.args`. A field that is missing from the JSON is None here.
+"""
+
+from sys import intern
+
+FIELDS = ("label", "op", "dest", "type", "args", "funcs", "labels", "value")
+
+
+class Instr:
+    """A Bril instruction, or a label when label is set."""
+
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(
+        self,
+        op=None,
+        dest=None,
+        type=None,
+        args=None,
+        funcs=None,
+        labels=None,
+        value=None,
+        label=None,
+        extra=None,
+    ):
+        self.label = label
+        self.op = op
+        self.dest = dest
+        self.type = type
+        self.args = args
+        self.funcs = funcs
+        self.labels = labels
+        self.value = value
+        # keys we don't model, e.g. source positions
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, d):
+        instr = cls(
+            d.get("op"),
+            d.get("dest"),
+            d.get("type"),
+            d.get("args"),
+            d.get("funcs"),
+            d.get("labels"),
+            d.get("value"),
+            d.get("label"),
+        )
+        # json gives every occurrence of a name its own string
+        if instr.op is not None:
+            instr.op = intern(instr.op)
+        if instr.dest is not None:
+            instr.dest = intern(instr.dest)
+        if instr.type.__class__ is str:
+            instr.type = intern(instr.type)
+        if instr.args is not None:
+            instr.args = [intern(arg) for arg in instr.args]
+        if len(d) > sum(1 for k in FIELDS if k in d):
+            instr.extra = {k: v for k, v in d.items() if k not in FIELDS}
+
+        return instr
+
+    def to_json(self):
+        d = {}
+        for k in FIELDS:
+            v = getattr(self, k)
+            if v is not None:
+                d[k] = v
+        if self.extra:
+            d.update(self.extra)
+
+        return d
+
+    def __eq__(self, other):
+        # compare by content like the JSON dicts did
+        if not isinstance(other, Instr):
+            return NotImplemented
+
+        return (
+            self.op == other.op
+            and self.dest == other.dest
+            and self.args == other.args
+            and self.label == other.label
+            and self.type == other.type
+            and self.funcs == other.funcs
+            and self.labels == other.labels
+            and self.value == other.value
+            and self.extra == other.extra
+        )
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Instr({self.to_json()})"
+
+
+def load_func(func):
+    """Convert a function's instructions from JSON dicts to Instr."""
+    func["instrs"] = [Instr.from_json(d) for d in func["instrs"]]
+
+
+def dump_func(func):
+    """Convert a function's instructions from Instr back to JSON dicts."""
+    func["instrs"] = [instr.to_json() for instr in func["instrs"]]
+
+
+def apply(opt, func):
+    """Run opt on a JSON function through Instr and return the JSON function."""
+    load_func(func)
+    opt(func)
+    dump_func(func)
+
+    return func
+
+
+def load(prog):
+    for func in prog["functions"]:
+        load_func(func)
+
+    return prog
+
+
+def dump(prog):
+    for func in prog["functions"]:
+        dump_func(func)
+
+    return prog
@@ -0,0 +1,138 @@
+"""Check whether a Bril program is in SSA form.
+
+    python3 is_ssa.py [--assign-only] < prog.json
+
+Prints "yes", or "no: " and the first violation. Functions are read one at
+a time and checking stops at the first violation, so a bad module is
+rejected without reading the rest of it.
+
+Every variable, arguments included, is assigned once. Unless --assign-only
+is given, every use must also be dominated by its definition (for a phi
+argument, the end of the block it comes from), and a phi must have one
+argument per predecessor. A phi argument that is never defined is fine, it
+leaves the dest undefined on that edge. Blocks the entry can't reach are
+not checked for dominance.
+"""
+
+import sys
+import basic_block
+import cfg as data
+import dom as dominator
+import ir
+import stream
+
+
+def where(func, label, k):
+    return f"@{func['name']}: .{label} instruction {k}"
+
+
+def assigned_twice(func):
+    """The first variable of a JSON function assigned a second time, as a
+    message, or None."""
+    seen = {arg["name"] for arg in func.get("args", [])}
+    label, k = basic_block.new_bb_name(0), 0
+    for instr in func["instrs"]:
+        if "label" in instr:
+            label, k = instr["label"], 0
+            continue
+
+        dest = instr.get("dest")
+        if dest is not None:
+            if dest in seen:
+                return f"{where(func, label, k)}: {dest} is assigned twice"
+            seen.add(dest)
+        k += 1
+
+    return None
+
+
+def not_dominated(func):
+    """The first use of an Instr function that its definition doesn't
+    dominate, or phi with the wrong arguments, as a message, or None."""
+    bb = basic_block.form_bb(func["instrs"])
+    cfg = data.CFG(bb)
+    dom = dominator.Dominators(cfg)
+    names = cfg.names
+
+    # variable -> (block id, index in block); arguments come before the entry
+    defs = {arg["name"]: (0, -1) for arg in func.get("args", [])}
+    for b, name in enumerate(names):
+        for k, instr in enumerate(bb[name]):
+            if instr.dest is not None:
+                defs[instr.dest] = (b, k)
+
+    for b, name in enumerate(names):
+        if not dom.dominates(0, b):
+            continue
+
+        preds = sorted(cfg.pred[name])
+        for k, instr in enumerate(bb[name]):
+            if instr.args is None:
+                continue
+
+            if instr.op == "phi":
+                if sorted(instr.labels) != preds or len(instr.args) != len(preds):
+                    return (
+                        f"{where(func, name, k)}: phi {instr.dest} has"
+                        f" {len(instr.args)} arguments from {instr.labels} for"
+                        f" predecessors {preds}"
+                    )
+                for arg, label in zip(instr.args, instr.labels):
+                    if arg not in defs:
+                        continue
+                    d, _ = defs[arg]
+                    if not dom.dominates(d, cfg.ids[label]):
+                        return (
+                            f"{where(func, name, k)}: {arg} from .{label} is not"
+                            f" dominated by its definition in .{names[d]}"
+                        )
+                continue
+
+            for arg in instr.args:
+                if arg not in defs:
+                    return f"{where(func, name, k)}: {arg} is never defined"
+                d, i = defs[arg]
+                if d == b and i >= k:
+                    return (
+                        f"{where(func, name, k)}: {arg} is used before its definition"
+                    )
+                if d != b and not dom.dominates(d, b):
+                    return (
+                        f"{where(func, name, k)}: {arg} is not dominated by its"
+                        f" definition in .{names[d]}"
+                    )
+
+    return None
+
+
+def first_violation(funcs, dominance=True):
+    """The first violation of SSA form in funcs (JSON functions), or None.
+
+    Stops reading funcs there. Without dominance only single assignment is
+    checked, on the JSON as it is.
+    """
+    for func in funcs:
+        problem = assigned_twice(func)
+        if problem is None and dominance:
+            ir.load_func(func)
+            problem = not_dominated(func)
+        if problem is not None:
+            return problem
+
+    return None
+
+
+def is_ssa(bril, dominance=True):
+    """Check whether a Bril program is in SSA form."""
+    return first_violation(bril["functions"], dominance) is None
+
+
+def main():
+    dominance = "--assign-only" not in sys.argv[1:]
+    funcs = stream.read_functions(sys.stdin, {})
+    problem = first_violation(funcs, dominance)
+    print("yes" if problem is None else f"no: {problem}")
+
+
+if __name__ == "__main__":
+    main()
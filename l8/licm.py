@@ -1,14 +1,18 @@
 import json, sys
+from collections import OrderedDict
+from functools import partial
 import basic_block
 import cfg as data
 import dom as dominator
 import dfa
+import ir
+import parallel
 
 
 class NLoop:
     """Natural loop"""
 
-    def __init__(self, cfg: data.CFG, dom) -> None:
+    def __init__(self, cfg: data.CFG, dom: dominator.Dominators) -> None:
         self.cfg = cfg
         self.dom = dom
         # head block is the entry of the natural loop
@@ -25,25 +29,100 @@ class NLoop:
 
         if len(self.head) == 1:
             head = list(self.head)[0]
-            pred = [x for x in cfg.pred[head] if x in dom[head]]
-            if len(pred) > 1 or len(pred) == 0:
-                # create a new prehead
-                new_name = "pre" + head
-                cfg.succ[new_name] = [head]
-                for new_pred in cfg.pred[head]:
-                    cfg.succ[new_pred].remove(head)
-                    cfg.succ[new_pred].add(new_name)
-
-                cfg.pred[head] = [new_name]
-                # empty prehead
-                cfg.bb[new_name] = []
-            elif len(pred) == 1:
-                self.prehead = list(pred)[0]
+            h = cfg.ids[head]
+            pred = [
+                x for x in cfg.pred[head] if x != head and dom.dominates(cfg.ids[x], h)
+            ]
+            # The prehead must run exactly when the loop is entered. Without
+            # a single dominating pred that only leads into the head, licm
+            # adds a new prehead block once it has something to hoist.
+            if len(pred) == 1 and cfg.succ[pred[0]] == [head]:
+                self.prehead = pred[0]
         else:
             # TODO: multiple head, might need to check which is the dominator
             # assert False
             pass
 
+    def add_prehead(self):
+        """Insert an empty block right before the head and send every edge
+        entering the loop through it; returns its name.
+
+        Blocks outside the loop that jump to the head jump to the prehead
+        instead, and the block before the head in layout falls through into
+        it. If that block is in the loop, it gets an explicit jmp to the head.
+        A phi in the head takes its values from outside the loop through the
+        prehead: with one outside predecessor only its label changes, with
+        several a new phi in the prehead merges them.
+        Only cfg.bb changes, so this is the last step before flattening.
+        """
+        cfg = self.cfg
+        head = next(iter(self.head))
+        name, n = "pre" + head, 0
+        while name in cfg.bb:
+            n += 1
+            name = f"pre{head}.{n}"
+
+        outside = [p for p in dict.fromkeys(cfg.pred[head]) if p not in self.body]
+        phis = []
+        taken = set()
+        for instrs in cfg.bb.values():
+            for instr in instrs:
+                taken.add(instr.dest)
+                taken.update(instr.args or ())
+        for phi in cfg.bb[head]:
+            if phi.op != "phi":
+                break
+            # this phi's (argument, label) pairs from outside the loop
+            entries = []
+            args, labels = [], []
+            for arg, label in zip(phi.args, phi.labels):
+                if label in outside:
+                    entries.append((arg, label))
+                else:
+                    args.append(arg)
+                    labels.append(label)
+            if not entries:
+                continue
+            if len(entries) == 1:
+                arg = entries[0][0]
+            else:
+                arg, k = phi.dest + ".pre", 0
+                while arg in taken:
+                    k += 1
+                    arg = f"{phi.dest}.pre.{k}"
+                taken.add(arg)
+                phis.append(
+                    ir.Instr(
+                        "phi",
+                        dest=arg,
+                        type=phi.type,
+                        args=[a for a, _ in entries],
+                        labels=[l for _, l in entries],
+                    )
+                )
+            phi.args = args + [arg]
+            phi.labels = labels + [name]
+
+        for pred in cfg.pred[head]:
+            instrs = cfg.bb[pred]
+            end = data.terminator(instrs)
+            if end is None:
+                if pred in self.body:
+                    block = basic_block.materialize(cfg.bb, pred)
+                    block.append(ir.Instr("jmp", labels=[head]))
+            elif pred not in self.body:
+                jump = instrs[end]
+                jump.labels = [name if l == head else l for l in jump.labels]
+
+        bb = OrderedDict()
+        for label, instrs in cfg.bb.items():
+            if label == head:
+                bb[name] = phis
+            bb[label] = instrs
+        cfg.bb = bb
+        self.prehead = name
+        return name
+
     def form_loop(self, dom, cfg: data.CFG):
         """Form natural loop
         1. Find dominators in CFG
@@ -51,30 +130,24 @@ class NLoop:
         3. Find natural loops associated with back edges
         """
 
-        # back_edges is the head of the back_edges
+        # back_edges are the (tail, head) pairs of the back edges
         back_edges = set()
-        entry = list(cfg.bb)[0]
-        visited = set()
-        self.dfs(entry, visited, back_edges)
+        visited = bytearray(len(cfg))
         # Not every graph is connected!
-        unvisited = [b for b in list(cfg.bb) if b not in visited]
-        while unvisited:
-            self.dfs(unvisited[0], visited, back_edges)
-            unvisited = [b for b in list(cfg.bb) if b not in visited]
-
-        # every block is visited
-        assert visited == set(cfg.bb)
+        for entry in range(len(cfg)):
+            if not visited[entry]:
+                self.dfs(entry, visited, back_edges)
 
         # body includes every block in a natural loop
         body = set()
         stk = []
-        for node in back_edges:
-            h = cfg.succ[node]
-            self.head |= set(h)
+        for tail, head in back_edges:
+            tail, head = cfg.names[tail], cfg.names[head]
+            self.head.add(head)
 
-            body |= set(h)
-            if node not in stk:
-                stk.append(node)
+            body.add(head)
+            if tail not in stk:
+                stk.append(tail)
 
         while stk:
             d = stk.pop(-1)
@@ -85,19 +158,25 @@ class NLoop:
 
         return body
 
-    def dfs(self, block, visited, back_edges):
-        if block in visited:
-            return
-
-        visited.add(block)
-        # block -> next_block
-        succ = self.cfg.succ[block]
-        for e in succ:
-            # block is the head of a back edge
-            if e in self.dom[block]:
-                back_edges.add(block)
-
-            self.dfs(e, visited, back_edges)
+    def dfs(self, entry, visited, back_edges):
+        """Walk the block ids reachable from entry, depth first."""
+        cfg = self.cfg
+        visited[entry] = 1
+        stack = [(entry, iter(cfg.succs(entry)))]
+        while stack:
+            block, succ = stack[-1]
+            # block -> next_block
+            for e in succ:
+                # block -> e is a back edge
+                if self.dom.dominates(e, block):
+                    back_edges.add((block, e))
+
+                if not visited[e]:
+                    visited[e] = 1
+                    stack.append((e, iter(cfg.succs(e))))
+                    break
+            else:
+                stack.pop()
 
     def print(self, name):
         print(f"function name: {name}")
@@ -106,7 +185,11 @@ class NLoop:
         print(f"loop body: {self.body}")
 
 
-def licm(loop: NLoop, cfg: data.CFG, var2block):
+# ops that may trap or touch memory or the outside world when hoisted
+UNSAFE = ["call", "alloc", "load", "div", "phi"]
+
+
+def licm(loop: NLoop, cfg: data.CFG, reach: dfa.Reaching):
     """Loop-Invariant Code Motion
 
     iterate to convergence:
@@ -116,83 +199,146 @@ def licm(loop: NLoop, cfg: data.CFG, var2block):
             there is exactly one definition, and it is already marked as
                 loop invariant
 
-    move Loop-Invariant instr to prehead block
+    move an LI instr to the prehead block if it is the only definition of
+    its dest in the loop, its block dominates every loop exit, and it is the
+    only definition reaching the uses of dest in the loop
     """
-    if len(loop.body) == 0:
+    if len(loop.body) == 0 or len(loop.head) != 1:
         return
 
+    reach.analyze_cfg(cfg)
+    # body block ids in layout order
+    body = sorted(cfg.ids[name] for name in loop.body)
+    exits = [
+        cfg.names[b]
+        for b in body
+        if any(s not in loop.body for s in cfg.succ[cfg.names[b]])
+    ]
+
+    # sites defined in the loop, and the sites reaching in-loop uses per var
+    in_loop = 0
+    uses = {}
+    for b in body:
+        instrs = cfg.bb[cfg.names[b]]
+        end = data.terminator(instrs)
+        if end is None:
+            end = len(instrs) - 1
+        for i in range(end + 1):
+            instr = instrs[i]
+            if instr.args is not None:
+                for arg in instr.args:
+                    uses[arg] = uses.get(arg, 0) | reach.before(b, i) & reach.var_mask(
+                        arg
+                    )
+            if instr.dest is not None:
+                in_loop |= 1 << reach.site[id(instr)]
+
+    # invariant sites as a mask, and as (block id, index) in discovery order
+    invariant = 0
     lis = []
     changed = True
     while changed:
         changed = False
-        for b in loop.body:
-            instrs = cfg.bb[b]
-            for instr in instrs:
-                if "args" in instr:
-                    is_invariant = True
-                    for arg in instr["args"]:
-                        # arg is defined only inside of loop
-                        if arg not in var2block:
-                            continue
-                        arg_def = var2block[arg]
-                        # arg is definied outside of loop body, not invariant
-                        if len(arg_def.intersection(loop.body)) > 0:
-                            is_invariant = False
-                            break
-
-                    if is_invariant and instr not in lis:
-                        lis.append(instr)
-                        changed = True
-
-    for instr in lis:
-        # skip instrs with side effects and jumps
-        if "op" in instr and instr["op"] in ["jmp", "br", "ret", "call"]:
+        for b in body:
+            instrs = cfg.bb[cfg.names[b]]
+            for i, instr in enumerate(instrs):
+                if instr.op in data.TERMINATORS:
+                    break
+                if instr.dest is None or instr.op in UNSAFE:
+                    continue
+                site = 1 << reach.site[id(instr)]
+                if invariant & site:
+                    continue
+
+                is_invariant = True
+                for arg in instr.args or []:
+                    defs = reach.before(b, i) & reach.var_mask(arg)
+                    # every definition comes from outside of the loop
+                    if not defs & in_loop:
+                        continue
+                    # exactly one definition, already invariant
+                    if defs & (defs - 1) == 0 and invariant & defs:
+                        continue
+                    is_invariant = False
+                    break
+
+                if is_invariant:
+                    invariant |= site
+                    lis.append((b, i))
+                    changed = True
+
+    moved = 0
+    hoist = []
+    for b, i in lis:
+        instr = cfg.bb[cfg.names[b]][i]
+        site = 1 << reach.site[id(instr)]
+        mask = reach.var_mask(instr.dest)
+        if in_loop & mask != site:
+            continue
+        if uses.get(instr.dest, site) != site:
+            continue
+        if any(not loop.dom.dominates(b, cfg.ids[e]) for e in exits):
             continue
-        for b in loop.body:
-            if instr in cfg.bb[b]:
-                cfg.bb[b].remove(instr)
-                cfg.bb[loop.prehead].append(instr)
+        # the in-loop definitions of its arguments must be hoisted too
+        deps = 0
+        for arg in instr.args or []:
+            deps |= reach.before(b, i) & reach.var_mask(arg) & in_loop
+        if deps & ~moved:
+            continue
+
+        moved |= site
+        hoist.append((b, i))
+
+    if not hoist:
+        return
+
+    if not loop.prehead:
+        loop.add_prehead()
+    prehead = basic_block.materialize(cfg.bb, loop.prehead)
+    end = data.terminator(prehead)
+    if end is None:
+        end = len(prehead)
+    prehead[end:end] = [cfg.bb[cfg.names[b]][i] for b, i in hoist]
+
+    gone = {}
+    for b, i in hoist:
+        gone.setdefault(b, set()).add(i)
+    for b, drop in gone.items():
+        block = basic_block.materialize(cfg.bb, cfg.names[b])
+        block[:] = [instr for i, instr in enumerate(block) if i not in drop]
 
 
 def flatten_cfg(cfg: data.CFG):
     new_instrs = []
     for b, i in cfg.bb.items():
-        label = {}
-        label["label"] = b
-        new_instrs.append(label)
+        new_instrs.append(ir.Instr(label=b))
         new_instrs.extend(i)
 
     return new_instrs
 
 
-def map_inv(succ):
-    out = {}
-    for b, vars in succ.items():
-        for v in vars:
-            if v not in out:
-                out[v] = set({b})
-            else:
-                out[v].add(b)
-
-    return out
+def optimize(func):
+    """Runs loop-invariant code motion on one function."""
+    bb = basic_block.form_bb(func["instrs"])
+    cfg = data.CFG(bb)
+    dom = dominator.Dominators(cfg)
+    # natural loop for optimization
+    loop = NLoop(cfg, dom)
+    # reaching definition
+    reach = dfa.Reaching(cfg)
+    licm(loop, cfg, reach)
+    new_instrs = flatten_cfg(cfg)
+    func["instrs"].clear()
+    func["instrs"] = new_instrs
 
 
 def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    dominator.parse_engine(sys.argv)
     prog = json.load(sys.stdin)
-    for func in prog["functions"]:
-        bb = basic_block.form_bb(func["instrs"])
-        cfg = data.CFG(bb)
-        dom = dominator.get_dom_v2(cfg)
-        # natural loop for optimization
-        loop = NLoop(cfg, dom)
-        # reaching definition
-        reach = dfa.Defined(cfg)
-        _, block2var = reach.analyze()
-        var2block = map_inv(block2var)
-        licm(loop, cfg, var2block)
-        new_instrs = flatten_cfg(cfg)
-        func["instrs"].clear()
-        func["instrs"] = new_instrs
+    parallel.optimize(
+        prog, optimize, jobs, partial(dominator.set_engine, dominator.ENGINE)
+    )
     json.dump(prog, sys.stdout, indent=2)
 
 
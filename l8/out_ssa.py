@@ -0,0 +1,373 @@
+import json, sys
+import basic_block
+import cfg as data
+import dfa
+import ir
+import parallel
+from functools import partial
+
+# naive: one copy per phi argument; coalesce: phi-related variables that
+# never interfere share a name first, so most of those copies disappear
+MODES = ["naive", "coalesce"]
+MODE = "coalesce"
+
+# values for variables a copy reads before they are defined; pointers have
+# no constant, so those stay undefined
+ZERO = {"int": 0, "bool": False, "float": 0.0}
+
+
+def parse_mode(argv):
+    """Remove "--copies=MODE" (or "--copies MODE") from argv and make it the
+    default."""
+    global MODE
+    for i, arg in enumerate(argv):
+        if arg == "--copies" or arg.startswith("--copies="):
+            if "=" in arg:
+                mode, n = arg.split("=", 1)[1], 1
+            else:
+                mode, n = argv[i + 1] if i + 1 < len(argv) else None, 2
+            if mode not in MODES:
+                print(f"--copies needs one of: {', '.join(MODES)}")
+                sys.exit(1)
+            MODE = mode
+            del argv[i : i + n]
+            return
+
+
+def set_mode(mode):
+    """Make mode the default; the pool initializer of main."""
+    global MODE
+    MODE = mode
+
+
+class PhiLive(dfa.Live):
+    """Liveness of the given variables, with phis read on their edges.
+
+    A phi defines its dest at the top of its block, like any definition, but
+    reads each argument at the end of the predecessor it comes from rather
+    than in its own block. exits maps a predecessor's instructions (by id,
+    the same object analyze_cfg passes to gen_kill) to those arguments.
+    Other variables get no bit, which keeps the masks small.
+    """
+
+    def __init__(self, cfg, exits, vars):
+        super().__init__(cfg)
+        self.exits = exits
+        for var in vars:
+            self.bit(var)
+
+    def gen_kill(self, instrs):
+        bits = self.bits
+        use = 0
+        for var in self.exits.get(id(instrs), ()):
+            use |= 1 << bits[var]
+        end = data.terminator(instrs)
+        if end is not None:
+            instrs = instrs[: end + 1]
+
+        defs = 0
+        for instr in reversed(instrs):
+            if instr.dest in bits:
+                dest = 1 << bits[instr.dest]
+                use &= ~dest
+                defs |= dest
+
+            if instr.args is not None and instr.op != "phi":
+                for arg in instr.args:
+                    if arg in bits:
+                        use |= 1 << bits[arg]
+
+        return (use, defs)
+
+
+def edge_copies(bb, cfg, defined):
+    """The parallel copy on every edge into a block with phis.
+
+    Returns {(pred id, block id): [(dest, src, type)]}. An argument that is
+    never defined gets no copy, so the dest stays undefined on that edge like
+    it would for the phi.
+    """
+    names = cfg.names
+    copies = {}
+    for b, name in enumerate(names):
+        phis = [instr for instr in bb[name] if instr.op == "phi"]
+        if not phis:
+            continue
+
+        for p in dict.fromkeys(cfg.preds(b)):
+            label = names[p]
+            group = []
+            for phi in phis:
+                for arg, pred in zip(phi.args, phi.labels):
+                    if pred == label:
+                        if arg in defined:
+                            group.append((phi.dest, arg, phi.type))
+                        break
+            if group:
+                copies[(p, b)] = group
+
+    return copies
+
+
+def maybe_undefined(bb, defined):
+    """Dests of phis that may not get a value: one of their arguments is
+    never defined, or is such a dest itself."""
+    # argument -> dests of the phis reading it
+    readers = {}
+    undefined = []
+    for block in bb.values():
+        for instr in block:
+            if instr.op != "phi":
+                continue
+            for arg in instr.args:
+                if arg in defined:
+                    readers.setdefault(arg, []).append(instr.dest)
+                else:
+                    undefined.append(instr.dest)
+
+    seen = set(undefined)
+    while undefined:
+        for dest in readers.get(undefined.pop(), ()):
+            if dest not in seen:
+                seen.add(dest)
+                undefined.append(dest)
+
+    return seen
+
+
+def interference(bb, cfg, copies):
+    """Which dests and sources of copies are live where another is defined.
+
+    Returns {var: set of those live at var's definition}. Every variable is
+    recorded at its own definition, so a pair that is live at the same time
+    shows up on at least one side. Dests of phis in the same block are
+    defined at once and always interfere.
+    """
+    names = cfg.names
+    exits = {}
+    vars = {}
+    for (p, _), group in copies.items():
+        srcs = exits.setdefault(id(bb[names[p]]), [])
+        for dest, src, _ in group:
+            srcs.append(src)
+            vars[dest] = vars[src] = None
+    live = PhiLive(cfg, exits, vars)
+    # backward: the merged input of a block is its live-out
+    live_out, _ = live.analyze_cfg(cfg)
+
+    nbr = {var: set() for var in vars}
+    for b, name in enumerate(names):
+        instrs = bb[name]
+        now = live.sparse_set(live_out[b])
+        now.update(exits.get(id(instrs), ()))
+        end = data.terminator(instrs)
+        if end is None:
+            end = len(instrs) - 1
+
+        phis = []
+        for i in range(end, -1, -1):
+            instr = instrs[i]
+            if instr.op == "phi":
+                phis.append(instr.dest)
+                continue
+            if instr.dest in nbr:
+                now.discard(instr.dest)
+                nbr[instr.dest] |= now
+            if instr.args is not None:
+                for arg in instr.args:
+                    if arg in nbr:
+                        now.add(arg)
+
+        now.update(dest for dest in phis if dest in nbr)
+        for dest in phis:
+            if dest in nbr:
+                nbr[dest] |= now
+                nbr[dest].discard(dest)
+
+    return nbr
+
+
+def coalesce(copies, args, nbr):
+    """Give non-interfering dests and sources of copies the same name.
+
+    Classes of variables are merged with union-find, keeping the set of
+    their members and of everything they interfere with, and the smaller set
+    is merged into the larger one. A function argument can't be renamed, so
+    it names its class, and two of them never share one.
+
+    Returns {var: name} for every variable that gets a new name.
+    """
+    parent = {}
+    members = {}
+    clash = {}
+
+    def find(v):
+        root = v
+        while root in parent:
+            root = parent[root]
+        while v != root:
+            parent[v], v = root, parent[v]
+        return root
+
+    for group in copies.values():
+        for dest, src, _ in group:
+            a, b = find(dest), find(src)
+            if a == b or a in args and b in args:
+                continue
+            for v in (a, b):
+                if v not in members:
+                    members[v] = {v}
+                    clash[v] = nbr[v]
+            if not members[a].isdisjoint(clash[b]):
+                continue
+            if not members[b].isdisjoint(clash[a]):
+                continue
+
+            if a in args:
+                a, b = b, a
+            # b names the merged class
+            parent[a] = b
+            for sets in (members, clash):
+                small, large = sets.pop(a), sets[b]
+                if len(small) > len(large):
+                    small, large = large, small
+                large |= small
+                sets[b] = large
+
+    return {v: find(v) for v in parent}
+
+
+def sequentialize(group, fresh):
+    """id instructions doing the parallel copy group one after another.
+
+    A copy goes once nothing still pending reads its dest. What is left then
+    are cycles, each broken by saving one dest in a fresh variable.
+    """
+    pending = {dest: (src, type) for dest, src, type in group if dest != src}
+    # variable -> number of pending copies reading it
+    reads = {}
+    for src, _ in pending.values():
+        reads[src] = reads.get(src, 0) + 1
+    ready = [dest for dest in pending if not reads.get(dest)]
+
+    instrs = []
+    while pending:
+        while ready:
+            dest = ready.pop()
+            src, type = pending.pop(dest)
+            instrs.append(ir.Instr("id", dest, type, args=[src]))
+            reads[src] -= 1
+            if reads[src] == 0 and src in pending:
+                ready.append(src)
+
+        if pending:
+            dest = next(iter(pending))
+            type = pending[dest][1]
+            tmp = fresh(dest)
+            instrs.append(ir.Instr("id", tmp, type, args=[dest]))
+            for var, (src, t) in pending.items():
+                if src == dest:
+                    pending[var] = (tmp, t)
+                    break
+            reads[tmp] = 1
+            reads[dest] = 0
+            ready.append(dest)
+
+    return instrs
+
+
+def out_ssa(func, mode=None):
+    """Replace phis by copies on the edges into their blocks.
+
+    The copies of an edge happen at the end of the predecessor when it has
+    no other successor, and otherwise in a new block that splits the edge.
+    mode (MODE by default) is one of MODES.
+    """
+    mode = mode or MODE
+    instrs = func["instrs"]
+    if not any(instr.op == "phi" for instr in instrs):
+        return
+
+    bb = basic_block.form_bb(instrs)
+    cfg = data.CFG(bb)
+    args = {arg["name"] for arg in func.get("args", [])}
+    taken = set(args)
+    for instr in instrs:
+        if instr.dest is not None:
+            taken.add(instr.dest)
+    copies = edge_copies(bb, cfg, taken)
+    undefined = maybe_undefined(bb, taken)
+
+    rename = {}
+    if mode == "coalesce" and copies:
+        rename = coalesce(copies, args, interference(bb, cfg, copies))
+    undefined = {rename.get(var, var) for var in undefined} - args
+    if rename:
+        for instr in instrs:
+            if instr.dest is not None:
+                instr.dest = rename.get(instr.dest, instr.dest)
+            if instr.args is not None:
+                instr.args = [rename.get(arg, arg) for arg in instr.args]
+
+    labels = set(cfg.names)
+
+    def fresh(base):
+        name, n = base, 0
+        while name in taken or name in labels:
+            n += 1
+            name = f"{base}.{n}"
+        taken.add(name)
+        return name
+
+    # position in instrs -> instructions to insert before it
+    inserts = {}
+    # a phi leaves its dest undefined when its argument is, but a copy of an
+    # undefined variable fails, so those get a value on entry
+    init = {}
+    names = cfg.names
+    for (p, b), group in copies.items():
+        group = [(rename.get(d, d), rename.get(s, s), t) for d, s, t in group]
+        seq = sequentialize(group, fresh)
+        if not seq:
+            continue
+        for instr in seq:
+            src, type = instr.args[0], instr.type
+            if src not in undefined or src in init or type.__class__ is not str:
+                continue
+            if type in ZERO:
+                init[src] = ir.Instr("const", src, type, value=ZERO[type])
+
+        block = bb[names[p]]
+        end = data.terminator(block)
+        if len(set(cfg.succs(p))) == 1 and (end is None or block[end].op == "jmp"):
+            at = block.end if end is None else block.start + end
+            inserts.setdefault(at, []).extend(seq)
+            continue
+
+        # a critical edge, or a br: the copies get a block of their own
+        label = fresh(f"{names[p]}.{names[b]}")
+        jump = block[end]
+        jump.labels = [label if l == names[b] else l for l in jump.labels]
+        split = [ir.Instr(label=label), *seq, ir.Instr("jmp", labels=[names[b]])]
+        inserts.setdefault(block.end, []).extend(split)
+
+    new_instrs = list(init.values())
+    for i, instr in enumerate(instrs):
+        if i in inserts:
+            new_instrs.extend(inserts[i])
+        if instr.op != "phi":
+            new_instrs.append(instr)
+    new_instrs.extend(inserts.get(len(instrs), ()))
+    func["instrs"] = new_instrs
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    parse_mode(sys.argv)
+    prog = json.load(sys.stdin)
+    parallel.optimize(prog, out_ssa, jobs, partial(set_mode, MODE))
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Optimize the functions of a program in a process pool.
+
+Every function is optimized independently, so functions are sent to worker
+processes and the results are collected in submission order. The output is
+the same as the sequential loop no matter how the workers are scheduled.
+"""
+
+import io
+import sys
+from collections import deque
+from contextlib import redirect_stdout
+from functools import partial
+from multiprocessing import Pool
+
+import ir
+
+# results we let the workers run ahead of the writer, per worker
+WINDOW = 4
+
+
+def parse_jobs(argv):
+    """Remove "--jobs N" (or "-j N") from argv and return N, 1 by default."""
+    for i, arg in enumerate(argv):
+        if arg in ("--jobs", "-j"):
+            if i + 1 >= len(argv) or not argv[i + 1].isdigit():
+                print(f"{arg} needs a number of processes")
+                sys.exit(1)
+            jobs = int(argv[i + 1])
+            del argv[i : i + 2]
+            return max(jobs, 1)
+
+    return 1
+
+
+class Done:
+    """A result that is already known and should skip the pool."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def map_funcs(fn, funcs, jobs, init=None):
+    """Yield fn(func) for every func, in order, using up to jobs processes.
+
+    funcs may be a generator, and a Done item is passed through unchanged.
+    At most jobs * WINDOW functions are in flight, so a streamed program is
+    still read incrementally.
+
+    init, if given, runs once in every worker first. Workers that are spawned
+    rather than forked (the default on macOS) start from fresh imports, so
+    options the passes read from module globals must be set again by init.
+    """
+    if jobs <= 1:
+        for func in funcs:
+            yield func.value if isinstance(func, Done) else fn(func)
+        return
+
+    with Pool(jobs, initializer=init) as pool:
+        pending = deque()
+        for func in funcs:
+            if not isinstance(func, Done):
+                func = pool.apply_async(fn, (func,))
+            pending.append(func)
+            if len(pending) >= jobs * WINDOW:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def optimize(prog, opt, jobs, init=None):
+    """Run opt, which rewrites one IR function in place, on every function."""
+    funcs = map_funcs(partial(ir.apply, opt), prog["functions"], jobs, init)
+    prog["functions"] = list(funcs)
+
+    return prog
+
+
+def capture(fn, func):
+    """Run fn on func and return what it printed and its exit status."""
+    out = io.StringIO()
+    code = None
+    with redirect_stdout(out):
+        try:
+            fn(func)
+        except SystemExit as e:
+            # exit() inside a pool worker would kill it and hang the pool
+            code = e.code
+
+    return out.getvalue(), code
+
+
+def print_funcs(fn, funcs, jobs, init=None):
+    """Run fn, which prints a report, on every function and print in order."""
+    for text, code in map_funcs(partial(capture, fn), funcs, jobs, init):
+        sys.stdout.write(text)
+        if code is not None:
+            sys.exit(code)
@@ -0,0 +1,202 @@
+import argparse
+import json, sys
+import lvn
+import dce
+import to_ssa
+import out_ssa
+import licm
+import constprop
+import gcse
+import gvn
+import cache
+import dom as dominator
+import ir
+import parallel
+import stream
+from collections import deque
+from functools import partial
+
+# pass name -> function that optimizes a single function in place
+PASSES = {
+    "lvn": lvn.lvn,
+    "dce": dce.dce,
+    "adce": dce.adce,
+    "to_ssa": to_ssa.to_ssa,
+    "out_ssa": out_ssa.out_ssa,
+    "licm": licm.optimize,
+    "constprop": constprop.constprop,
+    "gcse": gcse.gcse,
+    "gvn": gvn.gvn,
+}
+
+
+def optimize_func(func, passes):
+    """Run passes in order on one JSON function.
+
+    Every pass sees the output of the previous one without a JSON round-trip.
+    """
+    ir.load_func(func)
+    for name in passes:
+        PASSES[name](func)
+    ir.dump_func(func)
+
+    return func
+
+
+def modes():
+    """The --dom, --ssa and --copies in effect, which the passes read from
+    module globals."""
+    return (dominator.ENGINE, to_ssa.MODE, out_ssa.MODE)
+
+
+def set_modes(engine, ssa, copies):
+    """Make these the modes in effect. Pool workers run this first, since a
+    worker that is spawned rather than forked starts from the defaults."""
+    dominator.ENGINE = engine
+    to_ssa.MODE = ssa
+    out_ssa.MODE = copies
+
+
+def options(passes):
+    """passes plus the options that change what they produce, for cache keys."""
+    extra = []
+    if "to_ssa" in passes:
+        extra.append(f"--ssa={to_ssa.MODE}")
+    if "out_ssa" in passes:
+        extra.append(f"--copies={out_ssa.MODE}")
+    return passes + extra
+
+
+def optimize_funcs(funcs, passes, jobs=1, cache=None):
+    """Yield the optimized functions in order, skipping cached ones."""
+    opt = partial(optimize_func, passes=passes)
+    init = partial(set_modes, *modes())
+    if cache is None:
+        yield from parallel.map_funcs(opt, funcs, jobs, init)
+        return
+
+    # cache key of every function in flight, None for hits
+    keys = deque()
+
+    def lookup():
+        for func in funcs:
+            key = cache.key(func, options(passes))
+            hit = cache.get(key)
+            if hit is None:
+                keys.append(key)
+                yield func
+            else:
+                keys.append(None)
+                yield parallel.Done(hit)
+
+    for result in parallel.map_funcs(opt, lookup(), jobs, init):
+        key = keys.popleft()
+        if key is not None:
+            cache.put(key, result)
+        yield result
+
+
+def run_passes(prog, passes, jobs=1, cache=None):
+    funcs = optimize_funcs(prog["functions"], passes, jobs, cache)
+    prog["functions"] = list(funcs)
+
+    return prog
+
+
+def parse_passes(args):
+    passes = []
+    for arg in args:
+        for name in arg.split(","):
+            if name not in PASSES:
+                print(f"unknown pass: {name}")
+                sys.exit(1)
+            passes.append(name)
+
+    return passes
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Run Bril passes in one process.",
+        usage=f"python3 pipeline.py [options] <{'|'.join(PASSES)}>...",
+    )
+    parser.add_argument("passes", nargs="+")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="read, optimize and write one function at a time",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="optimize functions in this many processes",
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=cache.DEFAULT_DIR,
+        default=None,
+        metavar="DIR",
+        help=f"reuse results of unchanged functions (default: {cache.DEFAULT_DIR})",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=cache.DEFAULT_SIZE >> 20,
+        metavar="MB",
+        help="evict least recently used entries beyond this size",
+    )
+    parser.add_argument(
+        "--dom",
+        choices=["auto", *dominator.ENGINES],
+        default=dominator.ENGINE,
+        help="dominator engine (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--ssa",
+        choices=to_ssa.MODES,
+        default=to_ssa.MODE,
+        help="phi placement of to_ssa (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--copies",
+        choices=out_ssa.MODES,
+        default=out_ssa.MODE,
+        help="phi copies left by out_ssa (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--indent", type=int, default=None, help="pretty-print the output JSON"
+    )
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    passes = parse_passes(args.passes)
+    set_modes(args.dom, args.ssa, args.copies)
+    c = None
+    if args.cache is not None:
+        c = cache.Cache(args.cache, args.cache_size << 20)
+
+    if args.stream:
+        extra = {}
+        funcs = stream.read_functions(sys.stdin, extra)
+        opt_funcs = optimize_funcs(funcs, passes, args.jobs, c)
+        stream.write_program(sys.stdout, opt_funcs, extra, args.indent)
+    else:
+        prog = json.load(sys.stdin)
+        run_passes(prog, passes, args.jobs, c)
+        if args.indent is None:
+            # dumps uses the C encoder; dump to a file never does
+            sys.stdout.write(json.dumps(prog, separators=(",", ":")))
+        else:
+            json.dump(prog, sys.stdout, indent=args.indent)
+
+    if c is not None:
+        print(c.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""A long-lived optimizer that keeps the passes imported between runs.
+
+Start it once:
+
+    python3 server.py &
+
+and replace `python3 lvn.py` with `python3 client.py lvn` in a pipeline.
+Each request forks from the warm server, so passes with class-level state
+never see another request's data.
+
+Protocol, one request per connection:
+    client -> server: {"passes": [...], "indent": null}\\n<Bril JSON>
+    server -> client: ok\\n<Bril JSON>  or  error <message>\\n
+"""
+
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import tempfile
+
+import pipeline
+
+
+def default_socket():
+    name = f"bril-opt-{os.getuid()}.sock"
+    return os.environ.get("BRIL_OPT_SOCKET", os.path.join(tempfile.gettempdir(), name))
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            header = json.loads(self.rfile.readline())
+            passes = header["passes"]
+            unknown = [name for name in passes if name not in pipeline.PASSES]
+            if unknown:
+                raise ValueError(f"unknown pass: {', '.join(unknown)}")
+
+            prog = json.load(self.rfile)
+            pipeline.run_passes(prog, passes)
+            if header.get("indent") is None:
+                out = json.dumps(prog, separators=(",", ":"))
+            else:
+                out = json.dumps(prog, indent=header["indent"])
+        except Exception as e:
+            # read the rest of the request before replying: closing with it
+            # unread would break the client's send, and it would never see
+            # the error
+            while self.rfile.read(1 << 16):
+                pass
+            msg = str(e).replace("\n", " ")
+            self.wfile.write(f"error {type(e).__name__}: {msg}\n".encode())
+            return
+
+        self.wfile.write(b"ok\n")
+        self.wfile.write(out.encode())
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve Bril passes on a socket.")
+    parser.add_argument("--socket", default=default_socket())
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    # clean up the socket on kill as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with Server(args.socket, Handler) as server:
+        print(f"serving on {args.socket}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
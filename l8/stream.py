@@ -0,0 +1,120 @@
+"""Read and write a Bril program one function at a time.
+
+json.load needs the whole program in memory, and json.dump with an indent
+roughly doubles it again. read_functions decodes the "functions" array one
+element at a time from a file, so peak memory follows the largest function
+instead of the whole module.
+"""
+
+import json
+
+CHUNK = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+class Reader:
+    """A growing text buffer over a file with a cursor."""
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=CHUNK):
+        """Drop consumed text and read at least size more characters."""
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("unexpected end of Bril JSON")
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError(f"expected '{c}' at '{self.buf[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value, reading more input until it is complete."""
+        self.peek()
+        while True:
+            try:
+                val, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # read as much again as we already hold, so a function of
+                # size n costs O(n) retries in total instead of O(n^2)
+                if not self.fill(max(CHUNK, len(self.buf) - self.pos)):
+                    raise
+                continue
+
+            # a number may continue in the next chunk
+            if end == len(self.buf) and not self.eof:
+                if self.fill():
+                    continue
+            self.pos = end
+            return val
+
+
+def read_functions(fp, extra):
+    """Yield the functions of a Bril program one at a time.
+
+    Top-level keys other than "functions" are stored in extra.
+    """
+    r = Reader(fp)
+    r.expect("{")
+    if r.peek() == "}":
+        return
+
+    while True:
+        key = r.value()
+        r.expect(":")
+        if key == "functions":
+            r.expect("[")
+            if r.peek() == "]":
+                r.pos += 1
+            else:
+                while True:
+                    yield r.value()
+                    if r.peek() == "]":
+                        r.pos += 1
+                        break
+                    r.expect(",")
+        else:
+            extra[key] = r.value()
+
+        if r.peek() == "}":
+            return
+        r.expect(",")
+
+
+def write_program(fp, funcs, extra, indent=None):
+    """Write functions as they are produced, then the other top-level keys."""
+    separators = (",", ":") if indent is None else None
+    fp.write('{"functions":[')
+    for i, func in enumerate(funcs):
+        if i > 0:
+            fp.write(",")
+        # dumps uses the C encoder; dump to a file never does
+        fp.write(json.dumps(func, indent=indent, separators=separators))
+    fp.write("]")
+    for key, val in extra.items():
+        fp.write(f",{json.dumps(key)}:")
+        fp.write(json.dumps(val, indent=indent, separators=separators))
+    fp.write("}")
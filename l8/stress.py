@@ -0,0 +1,81 @@
+"""Check that many analyses can be alive and running at the same time.
+
+    bril2json < prog.bril | python3 stress.py [copies]
+
+Every function is copied `copies` times (100 by default) and all copies are
+analyzed by a thread pool, with a tiny switch interval so the threads are
+interleaved inside the passes. Every result is compared with the same
+analysis run alone, so state shared between CFG, Defined or Optimizer
+instances shows up as a mismatch.
+"""
+
+import copy
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import basic_block
+import cfg as data
+import dce
+import dfa
+import dom as dominator
+import ir
+import lvn
+
+THREADS = 32
+
+
+class Analysis:
+    """The CFG and the analyses of one function, kept alive together."""
+
+    def __init__(self, func):
+        self.func = copy.deepcopy(func)
+        ir.load_func(self.func)
+        self.cfg = data.CFG(basic_block.form_bb(self.func["instrs"]))
+        self.dom = dominator.Dominators(self.cfg).sets()
+        self.defined = dfa.Defined(self.cfg).analyze()
+
+        self.lvn = copy.deepcopy(func)
+        ir.apply(lvn.lvn, self.lvn)
+        self.dce = copy.deepcopy(func)
+        ir.apply(dce.dce, self.dce)
+
+    def result(self):
+        """Everything computed so far, read back from the live objects."""
+        return (
+            self.cfg.succ,
+            self.cfg.pred,
+            list(self.cfg.succ_idx),
+            list(self.cfg.pred_idx),
+            self.dom,
+            self.defined,
+            self.lvn,
+            self.dce,
+        )
+
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    funcs = json.load(sys.stdin)["functions"]
+
+    expected = [Analysis(func).result() for func in funcs]
+
+    # switch threads every few bytecodes instead of every 5ms
+    sys.setswitchinterval(1e-6)
+    with ThreadPoolExecutor(THREADS) as pool:
+        live = list(pool.map(Analysis, funcs * copies))
+
+    bad = 0
+    for i, analysis in enumerate(live):
+        func = funcs[i % len(funcs)]
+        if analysis.result() != expected[i % len(funcs)]:
+            print(f"copy {i // len(funcs)} of {func['name']} differs")
+            bad += 1
+
+    if bad:
+        sys.exit(1)
+    print(f"ok: {len(live)} analyses of {len(funcs)} functions")
+
+
+if __name__ == "__main__":
+    main()
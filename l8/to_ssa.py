@@ -0,0 +1,310 @@
+import json, sys
+import dom as dominator
+import basic_block
+import cfg as data
+import dfa
+import ir
+import parallel
+from functools import partial
+
+# phi placement: every frontier, only variables read across blocks, or only
+# where the variable is live
+MODES = ["minimal", "semi-pruned", "pruned"]
+MODE = "pruned"
+
+
+def parse_mode(argv):
+    """Remove "--ssa=MODE" (or "--ssa MODE") from argv and make it the default."""
+    global MODE
+    for i, arg in enumerate(argv):
+        if arg == "--ssa" or arg.startswith("--ssa="):
+            if "=" in arg:
+                mode, n = arg.split("=", 1)[1], 1
+            else:
+                mode, n = argv[i + 1] if i + 1 < len(argv) else None, 2
+            if mode not in MODES:
+                print(f"--ssa needs one of: {', '.join(MODES)}")
+                sys.exit(1)
+            MODE = mode
+            del argv[i : i + n]
+            return
+
+
+def set_options(mode, engine):
+    """Pool initializer: give a spawned worker the --ssa and --engine of the
+    parent."""
+    global MODE
+    MODE = mode
+    dominator.set_engine(engine)
+
+
+class Var:
+    def __init__(self, bb) -> None:
+        vars, var_type, defs = self.get_var_def(bb)
+        self.vars = vars
+        self.defs = defs
+        self.var_type = var_type
+
+    def get_var_def(self, bb):
+        """Get all variables and variable definition's block
+
+        input: basic_blocks within a function
+        output: vars contains all variables, defs[v] is the blocks where
+        variable is defined, in layout order
+        """
+
+        # variable -> type, in order of first definition
+        var_type = {}
+        defs = {}
+        for block in bb:
+            for instr in bb[block]:
+                # variable definition
+                if instr.dest is not None:
+                    var = instr.dest
+                    if var not in var_type:
+                        var_type[var] = instr.type
+                        defs[var] = []
+                    # blocks come in order, so a repeat is the last one
+                    if not defs[var] or defs[var][-1] != block:
+                        defs[var].append(block)
+
+        return (list(var_type), var_type, defs)
+
+
+def rename_vars(bb, cfg: data.CFG, dom: dominator.Dominators, stack, stack_num):
+    """Rename variables so each is defined once.
+
+    stack[v] is a stack of variable names (for every variable v)
+
+    rename(block):
+      for instr in block:
+        replace each argument to instr (except a ϕ-node's) with stack[old name]
+
+        replace instr's destination with a new name
+        push that new name onto stack[old name]
+
+      for s in block's successors:
+        for p in s's ϕ-nodes:
+          Assuming p is for a variable v, make it read from stack[v].
+
+      for b in blocks immediately dominated by block:
+        # That is, children in the dominance tree.
+        rename(b)
+
+      pop all the names we just pushed onto the stack
+
+    The recursion is an explicit stack of blocks to enter and to leave, so
+    deep dominator trees are fine. Every pushed name is also logged, and
+    leaving a block pops the log back to its length on entry.
+    """
+    names = cfg.names
+    # variables whose stack got a name, in push order
+    log = []
+    # start from the entry, then the unreachable blocks
+    roots = [b for b in range(len(cfg)) if dom.idom[b] == -1]
+    for root in roots:
+        # (block id, log length on entry, or -1 before entering)
+        work = [(root, -1)]
+        while work:
+            b, mark = work.pop()
+            if mark >= 0:
+                while len(log) > mark:
+                    stack[log.pop()].pop()
+                continue
+
+            work.append((b, len(log)))
+            for instr in bb[names[b]]:
+                if instr.args is not None and instr.op != "phi":
+                    args = instr.args
+                    for i, arg in enumerate(args):
+                        if stack.get(arg):
+                            args[i] = stack[arg][-1]
+
+                if instr.dest is not None:
+                    var = instr.dest
+                    new_name = var + "." + str(stack_num[var])
+                    stack_num[var] += 1
+                    instr.dest = new_name
+                    stack[var].append(new_name)
+                    log.append(var)
+
+            label = names[b]
+            for s in cfg.succs(b):
+                # ϕ-nodes only come first
+                for instr in bb[names[s]]:
+                    if instr.op != "phi":
+                        break
+                    for i, pred in enumerate(instr.labels):
+                        # the argument still has the variable's own name
+                        if pred == label and stack.get(instr.args[i]):
+                            instr.args[i] = stack[instr.args[i]][-1]
+
+            for c in reversed(dom.children(b)):
+                work.append((c, -1))
+
+
+def non_local(bb):
+    """Variables read in some block before being defined there.
+
+    Only these "non-local names" can need a phi; the others are always
+    defined in the block that reads them.
+    """
+    names = set()
+    for instrs in bb.values():
+        defined = set()
+        for instr in instrs:
+            if instr.args is not None:
+                for arg in instr.args:
+                    if arg not in defined:
+                        names.add(arg)
+            if instr.dest is not None:
+                defined.add(instr.dest)
+
+    return names
+
+
+def insert_phi(bb, vobject: Var, dom: dominator.Dominators, cfg: data.CFG, mode=None):
+    """Insert phi nodes when there are different definitions for a variable.
+
+    for v in vars:
+      worklist = Defs[v]  # Blocks where v is assigned.
+      for d in worklist:
+        for block in DF[d]:  # Dominance frontier.
+          Add a ϕ-node to block,
+            unless we have done so already.
+          Add block to the worklist (because it now writes to v!),
+            unless it has been in there.
+
+    has_phi[b] and queued[b] hold the index of the last variable that got a
+    phi in block id b and that put b on the worklist, so the checks need no
+    per-variable sets and every variable costs only the blocks it touches.
+
+    mode (MODE by default) is one of MODES. "semi-pruned" only places phis
+    for non-local names, and "pruned" only where the variable is live-in.
+    """
+    mode = mode or MODE
+    vars = vobject.vars
+    if mode == "semi-pruned":
+        names_read = non_local(bb)
+        vars = [v for v in vars if v in names_read]
+    live_in = None
+    if mode == "pruned":
+        live = dfa.Live(cfg)
+        # backward, so what flows out of a block is its live-in
+        _, live_in = live.analyze_cfg(cfg)
+        vars = [v for v in vars if v in live.bits]
+    names = cfg.names
+    ids = cfg.ids
+    defs = vobject.defs
+    has_phi = [-1] * len(cfg)
+    queued = [-1] * len(cfg)
+    # block id -> its phi nodes, in order of insertion
+    phis = {}
+
+    for i, v in enumerate(vars):
+        if live_in is not None:
+            bit = live.bits[v]
+        worklist = [ids[d] for d in defs[v]]
+        for d in worklist:
+            queued[d] = i
+
+        while worklist:
+            d = worklist.pop()
+            for f in dom.frontier(d):
+                if has_phi[f] == i:
+                    continue
+
+                has_phi[f] = i
+                if live_in is not None and not live_in[f] >> bit & 1:
+                    # dead here: no phi, so f does not define v either
+                    continue
+                # one argument per incoming edge, renamed later
+                preds = cfg.pred[names[f]]
+                phis.setdefault(f, []).append(
+                    ir.Instr(
+                        "phi",
+                        dest=v,
+                        type=vobject.var_type[v],
+                        args=[v] * len(preds),
+                        labels=list(preds),
+                    )
+                )
+                if queued[f] != i:
+                    queued[f] = i
+                    worklist.append(f)
+
+    for f, nodes in phis.items():
+        # the latest phi goes first, copying only the blocks that get one
+        basic_block.materialize(bb, names[f])[:0] = reversed(nodes)
+
+
+def form_new_instrs(bb):
+    """Form new instrs with phi instructions"""
+    final_instrs = []
+    for block, instrs in bb.items():
+        # print(block)
+        final_instrs.append(ir.Instr(label=block))
+        final_instrs.extend(instrs)
+
+    return final_instrs
+
+
+def form_stack_var(vobject: Var):
+    # var name -> stacks of var name
+    stack = {}
+    stack_num = {}
+
+    for var in vobject.vars:
+        stack[var] = []
+        stack_num[var] = 0
+
+    return stack, stack_num
+
+
+def add_entry(func, bb):
+    """Give func a new, empty entry block if some block jumps to the old one.
+
+    A phi there needs an argument for entering the function, and a label to
+    go with it. Returns the new bb, or None when func is left alone.
+    """
+    label = next(iter(bb))
+    if not any(label in (instr.labels or ()) for instr in func["instrs"]):
+        return None
+
+    name, n = "entry", 0
+    while name in bb:
+        n += 1
+        name = f"entry.{n}"
+    # a block that is jumped to starts with its label, so it stays in place
+    func["instrs"].insert(0, ir.Instr(label=name))
+    return basic_block.form_bb(func["instrs"])
+
+
+def to_ssa(func):
+    # init
+    bb = basic_block.form_bb(func["instrs"])
+    bb = add_entry(func, bb) or bb
+    cfg = data.CFG(bb)
+    dom = dominator.Dominators(cfg)
+
+    vobject = Var(bb)
+    insert_phi(bb, vobject, dom, cfg)
+    stack, stack_num = form_stack_var(vobject)
+    rename_vars(bb, cfg, dom, stack, stack_num)
+
+    instrs = form_new_instrs(bb)
+    func["instrs"] = instrs
+
+
+def main():
+    jobs = parallel.parse_jobs(sys.argv)
+    dominator.parse_engine(sys.argv)
+    parse_mode(sys.argv)
+    prog = json.load(sys.stdin)
+    init = partial(set_options, MODE, dominator.ENGINE)
+    parallel.optimize(prog, to_ssa, jobs, init)
+    json.dump(prog, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()